@@ -1,10 +1,26 @@
-from utils.data_structures import Node, Edge, DirectedGraph
+from utils.data_structures import LabeledNode, Node, Edge, DirectedGraph
 from typing import List, Union, Dict, Tuple
 from configurator import Configurator
+from compiled_network import CompiledNetwork, UNASSIGNED_VALUE, get_random_state, sync_random_state
+from sample_store import SampleStore
+from variable_elimination import VariableElimination
+from dbn_filtering import SliceTemplate, DBNFilter
+from parallel_sampling import SamplingPool
+from gibbs_sampling import GibbsSampler, potential_scale_reduction
+from importance_sampling import AdaptiveImportanceSampler
+from loopy_belief_propagation import LoopyBeliefPropagation
+from posterior_cache import Posterior, PosteriorCache
+from utils.instrumentation import metrics
+from statistics import NormalDist
+import itertools
+import numpy as np
 import random
+import time
 
 UNASSIGNED = None
 LEAKAGE = 0.001
+MIN_ADAPTIVE_ESS = 30  # adaptive sampling doesn't stop before reaching this effective sample size
+MIN_LEARNING_BATCH = 1000  # importance sampling proposals aren't learned from smaller batches
 
 
 def rnd(frac):
@@ -18,8 +34,10 @@ def bool2str(b):
 class NotImplementedException(Exception):
     pass
 
-class BNNode(Node):
+class BNNode(LabeledNode):
     """Represents a node in the Bayes-Network, with probability for being flooded or blocked"""
+    __slots__ = ('element', 'time', 'chance', 'value', 'parents', 'children', 'P')
+
     def __init__(self,
                  label:     str,
                  element:   Union[Node, Edge],
@@ -31,7 +49,6 @@ class BNNode(Node):
         self.time = int(time)
         self.chance = float(chance)
         self.value = UNASSIGNED  # flooded or blocked - None | True | False
-        self.temp = UNASSIGNED
         self.parents: List[BNNode] = parents
         self.children = []
         for p in self.parents:
@@ -44,53 +61,49 @@ class BNNode(Node):
     def has_parents(self):
         return len(self.parents) != 0
 
+    def get_cpt(self):
+        """P(node = True) for each parents assignment, ordered by the assignment's binary encoding"""
+        if not self.has_parents():
+            return [self.chance]
+        assignments = itertools.product([False, True], repeat=len(self.parents))
+        return [self.P[a if len(a) > 1 else a[0]] for a in assignments]
+
     def __str__(self):
         return self.label
 
     def __lt__(self, other):
         return (self.time, self.element.label) < (other.time, other.element.label)
 
-    @staticmethod
-    def get_all_bn_nodes() -> List[Node]:
-        return sorted(FloodBNNode.NODES.values()) + sorted(EdgeBNNode.EDGES.values())
-
-    @staticmethod
-    def get_all_bn_vertex() -> List[Node]:
-        return sorted(FloodBNNode.NODES.values())
-
-    def get_node_probability(self):
+    def get_node_probability(self, sample: Dict):
+        """:param sample: the assignments of the current sample so far (including the node's parents)"""
         raise NotImplementedException("Must be implemented by child classes")
 
 
 class FloodBNNode(BNNode):
     """Represents a node in the Bayes-Network, with probability for being flooded"""
-    NODES: Dict[Tuple[Node, int], BNNode] = {}
-    P_PERSISTENCE = 0  # modified in Simulator.parse_graph()
-
-    @staticmethod
-    def get_bn_edge_parents(e, t) -> List[BNNode]:
-        return [FloodBNNode.NODES[e.v1, t], FloodBNNode.NODES[e.v2, t]]
+    __slots__ = ('p_persistence', 'root', 'v')
 
-    def __init__(self, v: Node, time, chance: Union[str, float]=0, p_persistence=0):
-        FloodBNNode.NODES[v, time] = self
+    def __init__(self, v: Node, time, chance: Union[str, float]=0, p_persistence=0, parent: BNNode=None):
+        """:param parent: the vertex's node at the previous time unit (None at time 0)"""
         self.p_persistence = p_persistence
-        parent_bn_nodes = [] if time == 0 else [FloodBNNode.NODES[v, time - 1]]
+        self.root: FloodBNNode = self if parent is None else parent.root  # the vertex's node at time 0
+        parent_bn_nodes = [] if parent is None else [parent]
         super().__init__('Fl({},{})'.format(v, time), v, time, chance, parents=parent_bn_nodes)
         self.v = v
 
     def get_conditional_probabilities(self):
-        original_chance = FloodBNNode.NODES[self.element, 0].chance
+        original_chance = self.root.chance
         flooded_last_tick = True
         return {
-                flooded_last_tick:  FloodBNNode.P_PERSISTENCE,
+                flooded_last_tick:  self.p_persistence,
             not flooded_last_tick:  original_chance
         }
 
-    def get_node_probability(self):
+    def get_node_probability(self, sample: Dict):
         if not self.has_parents():
             return self.chance
         else:
-            parent_flooded = self.parents[0].temp  # parent's assignment for the current sample) - treated as a fact
+            parent_flooded = sample[self.parents[0]]  # parent's assignment for the current sample) - treated as a fact
             return self.P[parent_flooded]
             # pf = self.parents[0].get_node_probability()  # prob his parent is flooded
             # return rnd(pf * self.P[True] + (1 - pf) * self.P[False])
@@ -116,12 +129,11 @@ class FloodBNNode(BNNode):
 
 
 class EdgeBNNode(BNNode):
-    EDGES: Dict[Tuple[Edge, int], BNNode] = {}
+    __slots__ = ('e',)
 
-    def __init__(self, e: Edge, time):
-        EdgeBNNode.EDGES[e, time] = self
-        parent_bn_nodes = FloodBNNode.get_bn_edge_parents(e, time)
-        super().__init__('B({},{})'.format(e.label, time), e, time, parents=parent_bn_nodes)
+    def __init__(self, e: Edge, time, parents: List[FloodBNNode]):
+        """:param parents: the flooding nodes of the edge's vertices at the same time unit"""
+        super().__init__('B({},{})'.format(e.label, time), e, time, parents=parents)
         self.e = e
 
     def get_conditional_probabilities(self):
@@ -146,27 +158,49 @@ class EdgeBNNode(BNNode):
                                                                         self.parents[1], bool2str(flooded_v2),
                                                                         chance))
 
-    def get_node_probability(self):
+    def get_node_probability(self, sample: Dict):
         # parents' assignments for the current sample) - treated as a fact
-        v1_flooded = self.parents[0].temp
-        v2_flooded = self.parents[1].temp
+        v1_flooded = sample[self.parents[0]]
+        v2_flooded = sample[self.parents[1]]
         return self.P[v1_flooded, v2_flooded]
 
 
 class BayesNetwork:
-    def __init__(self, V: List[BNNode]):
-        E = []
-        for p in V:
-            for c in p.children:
-                E.append(Edge(p, c, directed=True))
+    def __init__(self, V: List[BNNode], compiled: CompiledNetwork = None):
+        """:param compiled: the nodes' compiled network, e.g. from a snapshot - skips building and sorting the DAG"""
         self.V: List[BNNode] = V
         self.E: List[Edge] = []
-        self.G: DirectedGraph = DirectedGraph(V, E)
+        self.G: Union[DirectedGraph, None] = None  # created on first use
         self.nodes: Dict[Tuple[str, int], BNNode] = {}
         for bn_node in V:
             label, t = bn_node.element.label, bn_node.time
             self.nodes[label, t] = bn_node
-        self.top_sorted_V: List[BNNode] = self.G.topological_sort()
+        if compiled is None:
+            with metrics.timer('topological_sort'):
+                self.top_sorted_V: List[BNNode] = self.get_dag().topological_sort()
+            # the nodes' parents and children hold the structure, the DAG is created again only to be displayed
+            self.G = None
+            with metrics.timer('compile'):
+                self.compiled = CompiledNetwork.from_nodes(self.top_sorted_V)
+        else:
+            if compiled.n_nodes != len(V):
+                raise ValueError('the compiled network does not match the nodes')
+            labeled_nodes = {str(v): v for v in V}
+            self.top_sorted_V: List[BNNode] = [labeled_nodes[label] for label in compiled.labels]
+            self.compiled = compiled
+        self.index: Dict[BNNode, int] = {v: i for i, v in enumerate(self.top_sorted_V)}  # sample store columns
+        self.samples_cache: Dict[Tuple, SampleStore] = {}  # samples of the current evidence, by (evidence, seed, N)
+        self.exact_engine: Union[VariableElimination, None] = None  # created on first use
+        self.worker_pool: Union[SamplingPool, None] = None  # created on first use
+        self.sampling_report: Dict = {}  # accuracy report of the last adaptive sampling
+        # query results of the evidence states seen so far (None - disabled)
+        self.posterior_cache: Union[PosteriorCache, None] = \
+            PosteriorCache(int(Configurator.cache_size * 2 ** 20)) if Configurator.cache_size > 0 else None
+
+    def get_dag(self) -> DirectedGraph:
+        if self.G is None:
+            self.G = DirectedGraph(self.V, [Edge(p, c, directed=True) for p in self.V for c in p.children])
+        return self.G
 
     def get_nodes(self):
         return sorted(self.V)
@@ -174,69 +208,270 @@ class BayesNetwork:
     def print_net(self):
         for bn in self.get_nodes():
             bn.print_probability_table()
-        self.G.display('Bayes Network')
+        self.get_dag().display('Bayes Network')
 
     def reset_evidence(self):
         for bn in self.get_nodes():
             bn.value = UNASSIGNED
+        self.samples_cache.clear()
+
+    def add_evidence(self, bn_node: BNNode, value: bool, incremental=False):
+        """
+        :param incremental: update the samples of the current evidence to the new evidence, instead of discarding them
+        """
+        # Gibbs samples are kept whole, so their chains stay of equal length for the convergence diagnostics
+        reuse = incremental and Configurator.engine == 'lw'
+        samples = self.samples_cache.get(self.get_samples_key()) if reuse else None
+        self.samples_cache.clear()
+        if samples is not None:
+            samples = self.reweight_samples(samples, bn_node, value)
+        bn_node.value = value
+        min_ess = Configurator.ess_threshold * Configurator.sample_size
+        if samples is not None and samples.effective_sample_size() >= min_ess:
+            self.samples_cache[self.get_samples_key()] = samples
+
+    def reweight_samples(self, samples: SampleStore, bn_node: BNNode, value: bool) -> Union[SampleStore, None]:
+        """
+        Incremental likelihood weighting - adapt weighted samples to a new piece of evidence, in O(N).
+        A leaf (a blockage node - no children) is sampled last, so its value affects no other node: the weights are
+        multiplied by P(value | its parents in the sample), as likelihood weighting would, and all the samples are kept.
+        Otherwise the likelihood of the new evidence given the sample is 1 if the sample agrees with it and 0
+        otherwise - the rejected samples are dropped.
+        :return: the samples for the new evidence, or None if an existing evidence was changed (no valid samples)
+        """
+        if bn_node.value is not UNASSIGNED:
+            return samples if bn_node.value == value else None
+        i = self.index[bn_node]
+        if self.compiled.is_leaf[i]:
+            likelihood = samples.get_leaf_probabilities(np.array([value]), self.compiled.parents[[i]],
+                                                        self.compiled.cpt[[i]])[:, 0]
+            reweighted = samples.with_column(i, value)
+            return SampleStore(reweighted.bits, samples.weights * likelihood, samples.n_nodes)
+        return samples[samples.column(i) == value]
 
     def get_node(self, label, t):
         return self.nodes.get((label, t))
 
     """SAMPLING"""
     def get_evidence(self):
-        return {v: v.value for v in self.get_nodes() if v.value is not UNASSIGNED}
+        """the evidence nodes and values, in get_nodes order (only the evidence nodes are sorted)"""
+        return {v: v.value for v in sorted(v for v in self.V if v.value is not UNASSIGNED)}
+
+    def get_evidence_vector(self):
+        """evidence values indexed like the compiled network nodes"""
+        return np.array([UNASSIGNED_VALUE if v.value is UNASSIGNED else int(v.value) for v in self.top_sorted_V],
+                        dtype=np.int64)
 
     def get_single_weighted_sample(self):
-        """Weighted likelihood sampling - generate a single sample"""
+        """Weighted likelihood sampling - generate a single sample (reference implementation of the vectorized one)"""
         sample = {}
         weight = 1
         for v in self.top_sorted_V:
-            v.temp = UNASSIGNED
-            conditional_prob = v.get_node_probability()
+            conditional_prob = v.get_node_probability(sample)
             if v.value is not UNASSIGNED:
                 # v is an evidence var. it is fixed and accounted for by re-weighting with it's probability as a factor
-                v.temp = v.value
-                weight *= conditional_prob
+                sample[v] = v.value
+                weight *= conditional_prob if v.value else 1 - conditional_prob
             else:
                 # assign a "True" value to the node with this probability
-                v.temp = random.random() < conditional_prob
-            sample[v] = v.temp
+                sample[v] = random.random() < conditional_prob
         return sample, weight
 
-    def generate_weighted_samples(self):
-        """Weighted likelihood sampling - generate a set of samples"""
-        if Configurator.seed != 0:
-            random.seed(Configurator.seed)
-        weighted_samples: List[Tuple[Dict[BNNode,bool]], float] = \
-            [self.get_single_weighted_sample() for i in range(Configurator.sample_size)]
-        return weighted_samples
-
-    def sample_consistant_with_assignment(self, sw, a):
-        s, _ = sw
-        for v in a.keys():
-            if s[v] != a[v]:
-                return False
-        return True
-
-    def filter_samples(self, weighted_samples, assignment):
-        return [s for s in weighted_samples if self.sample_consistant_with_assignment(s, assignment)]
+    def generate_weighted_samples(self) -> SampleStore:
+        """
+        Weighted likelihood sampling - generate a set of samples
+        (or importance sampling, or Gibbs sampling with unit weights - if chosen)
+        """
+        if Configurator.engine == 'gibbs':
+            return self.generate_gibbs_samples()
+        if Configurator.engine == 'is':
+            return self.generate_importance_samples()
+        if Configurator.workers > 1:
+            if self.worker_pool is None:
+                self.worker_pool = SamplingPool(self.compiled, Configurator.workers)
+            return self.worker_pool.generate_samples(self.get_evidence_vector(), Configurator.sample_size,
+                                                     Configurator.seed)
+        rng = get_random_state(Configurator.seed)
+        samples = self.compiled.generate_samples(self.get_evidence_vector(), Configurator.sample_size, rng)
+        sync_random_state(rng)
+        return samples
+
+    def generate_gibbs_samples(self) -> SampleStore:
+        """Gibbs sampling - the samples of all the chains, chain after chain"""
+        rng = get_random_state(Configurator.seed)
+        sampler = GibbsSampler(self.compiled, self.get_evidence_vector())
+        chains = sampler.run(Configurator.sample_size, Configurator.chains, Configurator.burn_in, Configurator.thin,
+                             rng)
+        sync_random_state(rng)
+        return SampleStore.concatenate(chains)
+
+    def generate_importance_samples(self) -> SampleStore:
+        """
+        Adaptive importance sampling - learn a proposal from batches of samples, then draw the N samples from it.
+        The effective sample sizes are kept in self.sampling_report
+        """
+        start_time = time.time()
+        rng = get_random_state(Configurator.seed)
+        proposal = self.get_lbp_proposal() if Configurator.lbp_proposal else None
+        sampler = AdaptiveImportanceSampler(self.compiled, self.get_evidence_vector(), proposal)
+        batch_size = max(MIN_LEARNING_BATCH, Configurator.sample_size // max(1, Configurator.learning_batches))
+        sampler.learn(Configurator.learning_batches, batch_size, rng)
+        samples = sampler.generate_samples(Configurator.sample_size, rng)
+        sync_random_state(rng)
+        initial_ess = sampler.effective_sample_sizes[0] if sampler.effective_sample_sizes else float('nan')
+        self.sampling_report = {'samples': len(samples),
+                                'learning_samples': Configurator.learning_batches * batch_size,
+                                'effective_sample_size': float(samples.effective_sample_size()),
+                                'initial_effective_sample_size': initial_ess * len(samples),
+                                'seconds': time.time() - start_time}
+        return samples
+
+    def get_samples_key(self):
+        evidence = tuple(sorted((str(v), val) for v, val in self.get_evidence().items()))
+        sampler = {'gibbs': ('gibbs', Configurator.chains, Configurator.burn_in, Configurator.thin),
+                   'is': ('is', Configurator.learning_batches)}.get(Configurator.engine, ('lw',))
+        return evidence, Configurator.seed, Configurator.sample_size, sampler
+
+    def get_weighted_samples(self) -> SampleStore:
+        """the samples for the current evidence, generated once and reused by all the queries until evidence changes"""
+        key = self.get_samples_key()
+        if key not in self.samples_cache:
+            self.samples_cache.clear()
+            with metrics.timer('sampling'):
+                samples = self.generate_weighted_samples()
+            metrics.count('samples_drawn', len(samples))
+            metrics.gauge('effective_sample_size', float(samples.effective_sample_size()))
+            self.samples_cache[key] = samples
+        return self.samples_cache[key]
+
+    def get_assignment_columns(self, assignment: Dict[BNNode, bool]):
+        """the assignment's nodes ordinals (sample store columns) and values"""
+        nodes = [self.index[v] for v in assignment.keys()]
+        values = [bool(val) for val in assignment.values()]
+        return nodes, values
+
+    def sample_consistant_with_assignment(self, weighted_samples: SampleStore, a: Dict[BNNode, bool]):
+        """:return: a mask of the samples consistent with the assignment"""
+        return weighted_samples.consistent_with(*self.get_assignment_columns(a))
+
+    @metrics.timed('filter_samples')
+    def filter_samples(self, weighted_samples: SampleStore, assignment):
+        return weighted_samples[self.sample_consistant_with_assignment(weighted_samples, assignment)]
 
     def filter_by_evidence(self, weighted_samples):
         evidence: Dict[BNNode, bool] = self.get_evidence()
         return self.filter_samples(weighted_samples, evidence)
 
-    def sample(self, weighted_samples, query: Dict[BNNode, bool]):
+    def compile_queries(self, queries: List[Dict[BNNode, bool]]):
+        """
+        :return: the distinct literals (node ordinal, value) of the queries,
+                 a (n_literals x n_queries) incidence matrix of the literals of each query,
+                 and the CPTs of the Rao-Blackwellized literals (None if disabled)
+        """
+        literals: Dict[Tuple[int, bool], int] = {}
+        entries = []
+        for q, query in enumerate(queries):
+            for node, value in zip(*self.get_assignment_columns(query)):
+                entries.append((literals.setdefault((node, value), len(literals)), q))
+        incidence = np.zeros((len(literals), len(queries)), dtype=np.float32)
+        for literal, q in entries:
+            incidence[literal, q] = 1
+        nodes = [node for node, value in literals.keys()]
+        values = [value for node, value in literals.keys()]
+        return nodes, values, incidence, self.get_leaf_cpts(nodes)
+
+    def get_leaf_cpts(self, nodes: List[int]):
+        """
+        Rao-Blackwellization of the literals of unobserved leaves (edge blockages):
+        :return: (positions of these literals, their parents, their CPTs), or None if disabled or there are none
+        """
+        if not Configurator.rao_blackwell:
+            return None
+        nodes = np.asarray(nodes, dtype=np.int64)
+        unobserved = self.get_evidence_vector() == UNASSIGNED_VALUE
+        positions = np.flatnonzero(self.compiled.is_leaf[nodes] & unobserved[nodes])
+        if not len(positions):
+            return None
+        leaves = nodes[positions]
+        return positions, self.compiled.parents[leaves], self.compiled.cpt[leaves]
+
+    def get_free_probabilities(self, weighted_samples: SampleStore, bn_node: BNNode) -> np.ndarray:
+        """the per-sample probability that the node is False - Rao-Blackwellized if enabled and possible"""
+        i = self.index[bn_node]
+        leaf_cpts = self.get_leaf_cpts([i])
+        if leaf_cpts is None:
+            return (~weighted_samples.column(i)).astype(np.float64)
+        return weighted_samples.get_leaf_probabilities(np.array([False]), *leaf_cpts[1:])[:, 0]
+
+    def sample_many(self, weighted_samples: SampleStore, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """Weighted likelihood sampling - the probabilities of all the queries, evaluated in a single pass"""
+        if not queries:
+            return []
+        total_weight = weighted_samples.total_weight()
+        match_weights = weighted_samples.match_weights(*self.compile_queries(queries))
+        return (match_weights / total_weight).tolist()
+
+    def sample(self, weighted_samples: SampleStore, query: Dict[BNNode, bool]):
         """
         Weighted likelihood sampling
         :param query: a dict of {BNNode(BayerNetworkNode):value(True/False)} pairs
-        :param weighted_samples: a list of tuples containing: a dict ({BNNode:value} pairs) and weight for each sample
+        :param weighted_samples: the samples store - bit-packed samples and their weights
         :return: a sampling based probability for the query given the evidence
         """
-        matching_samples = self.filter_samples(weighted_samples, query)
-        total_weight = sum([weight for sample, weight in weighted_samples])
-        match_weight = sum([weight for sample, weight in matching_samples])
-        return match_weight/total_weight
+        match = self.sample_consistant_with_assignment(weighted_samples, query)
+        total_weight = weighted_samples.total_weight()
+        match_weight = weighted_samples.weights[match].sum()
+        return float(match_weight / total_weight)
+
+    def gibbs_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """
+        Gibbs sampling - the probabilities of the queries, averaged over all the chains.
+        The chains' convergence (R-hat of every query) is kept in self.sampling_report
+        """
+        start_time = time.time()
+        samples = self.get_weighted_samples()
+        probabilities = self.sample_many(samples, queries)
+        n_chains = Configurator.chains
+        n = len(samples) // n_chains
+        if queries and n > 1:
+            compiled_queries = self.compile_queries(queries)
+            chains = [samples[c * n:(c + 1) * n] for c in range(n_chains)]
+            means = np.array([chain.match_weights(*compiled_queries) / n for chain in chains])
+            squares = np.array([chain.match_weights(*compiled_queries, square_matches=True) / n for chain in chains])
+            r_hat = potential_scale_reduction(means, (squares - np.square(means)) * n / (n - 1), n).tolist()
+        else:
+            r_hat = [float('nan')] * len(queries)
+        self.sampling_report = {'samples': len(samples), 'chains': n_chains, 'r_hat': r_hat,
+                                'seconds': time.time() - start_time}
+        return probabilities
+
+    def print_gibbs_report(self):
+        report = self.sampling_report
+        print('{} samples in {} chains ({} seconds), max R-hat {}'.format(
+              report['samples'], report['chains'], rnd(report['seconds']), rnd(max(report['r_hat'] + [1]))))
+
+    def print_importance_sampling_report(self):
+        report = self.sampling_report
+        print('{} samples from a proposal learned on {} samples ({} seconds), effective sample size {} '
+              '({} with the initial proposal)'.format(report['samples'], report['learning_samples'],
+                                                      rnd(report['seconds']), round(report['effective_sample_size']),
+                                                      round(report['initial_effective_sample_size'])))
+
+    def get_sample_count(self) -> int:
+        """the number of samples behind the last query results (0 for the engines that don't sample)"""
+        posterior = None if self.posterior_cache is None else self.posterior_cache.peek(self.get_posterior_key())
+        return self.count_samples() if posterior is None else posterior.samples
+
+    def count_samples(self) -> int:
+        """the number of samples behind the query results just evaluated"""
+        if Configurator.engine in ('exact', 'lbp'):
+            return 0
+        if Configurator.engine == 'lw' and Configurator.epsilon > 0:
+            return self.sampling_report.get('samples', 0)
+        if Configurator.engine == 'filter' or (Configurator.engine == 'lw' and Configurator.prune):
+            return Configurator.sample_size
+        samples = self.samples_cache.get(self.get_samples_key())
+        return 0 if samples is None else len(samples)
 
     def query_results_tostring(self, query, evidence, prob):
         def join(q):
@@ -248,12 +483,278 @@ class BayesNetwork:
         query, evidence, prob = query_evidence_prob
         print(self.query_results_tostring(query, evidence, prob))
 
+    def get_pruned_network(self, queries: List[Dict[BNNode, bool]]) -> Tuple[CompiledNetwork, np.ndarray]:
+        """
+        Relevance pruning - the subnetwork of the nodes needed for the queries given the current evidence
+        (see CompiledNetwork.get_requisite_nodes)
+        :return: the pruned network, and the position of every node in it (-1 if pruned)
+        """
+        query_nodes = sorted({node for query in queries for node in self.get_assignment_columns(query)[0]})
+        evidence = self.get_evidence_vector()
+        with metrics.timer('relevance_pruning'):
+            nodes = self.compiled.get_requisite_nodes(query_nodes, evidence)
+        metrics.count('requisite_nodes', len(nodes))
+        position = np.full(self.compiled.n_nodes, -1, dtype=np.int64)
+        position[nodes] = np.arange(len(nodes))
+        return self.compiled.subnetwork(nodes, evidence), position
+
+    def pruned_exact_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """Variable elimination over the queries' pruned network"""
+        network, position = self.get_pruned_network(queries)
+        evidence = {int(position[node]): int(value) for node, value in zip(*self.get_assignment_columns(
+            self.get_evidence())) if position[node] >= 0}
+        compiled_queries = [(position[nodes].tolist(), values)
+                            for nodes, values in (self.get_assignment_columns(q) for q in queries)]
+        return VariableElimination(network).query(compiled_queries, evidence)
+
+    def pruned_sample_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """
+        Likelihood weighting over the queries' pruned network - only the nodes relevant to these queries are sampled,
+        so the samples are not shared with other queries
+        """
+        if not queries:
+            return []
+        network, position = self.get_pruned_network(queries)
+        rng = get_random_state(Configurator.seed)
+        with metrics.timer('sampling'):
+            samples = network.generate_samples(self.get_evidence_vector()[position >= 0], Configurator.sample_size,
+                                               rng)
+        sync_random_state(rng)
+        metrics.count('samples_drawn', len(samples))
+        metrics.gauge('effective_sample_size', float(samples.effective_sample_size()))
+        nodes, values, incidence, leaf_cpts = self.compile_queries(queries)
+        if leaf_cpts is not None:
+            literal_positions, parents, cpt = leaf_cpts
+            leaf_cpts = literal_positions, np.where(parents >= 0, position[parents], -1), cpt
+        return (samples.match_weights(position[nodes], values, incidence, leaf_cpts) /
+                samples.total_weight()).tolist()
+
+    def exact_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """Variable elimination - the exact probabilities of the queries given the evidence"""
+        if Configurator.prune:
+            return self.pruned_exact_queries(queries)
+        if self.exact_engine is None:
+            self.exact_engine = VariableElimination(self.compiled)
+        evidence = {node: int(value) for node, value in zip(*self.get_assignment_columns(self.get_evidence()))}
+        return self.exact_engine.query([self.get_assignment_columns(q) for q in queries], evidence)
+
+    def get_slice_template(self) -> SliceTemplate:
+        """the structure and CPTs of a single time slice, taken from the nodes of time 0"""
+        vertices = sorted(v for v in self.V if isinstance(v, FloodBNNode) and v.time == 0)
+        edges = sorted(e for e in self.V if isinstance(e, EdgeBNNode) and e.time == 0)
+        vertex_index = {v.element: i for i, v in enumerate(vertices)}
+        flood_cpt = []
+        for v in vertices:
+            flood_cpt.append([v.chance, v.P[False], v.P[True]])
+        return SliceTemplate([v.element.label for v in vertices],
+                             np.array(flood_cpt, dtype=np.float64),
+                             [e.element.label for e in edges],
+                             np.array([[vertex_index[e.element.v1], vertex_index[e.element.v2]] for e in edges],
+                                      dtype=np.int64).reshape(-1, 2),
+                             np.array([e.get_cpt() for e in edges], dtype=np.float64).reshape(-1, 4))
+
+    @staticmethod
+    def get_literals(template: SliceTemplate, assignment: Dict[BNNode, bool]):
+        return [template.get_literal(v.element.label, v.time, val) for v, val in assignment.items()]
+
+    @staticmethod
+    def get_horizon(evidence, literal_queries):
+        """the number of slices up to the last queried/observed one - later slices don't affect the queries"""
+        return max([t for t, _, _, _ in evidence] + [t for q in literal_queries for t, _, _, _ in q] + [-1]) + 1
+
+    def filter_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """
+        Slice by slice particle filtering - only the slices up to the last queried/observed one are sampled,
+        and only one slice is held in memory at a time
+        """
+        template = self.get_slice_template()
+        evidence = self.get_literals(template, self.get_evidence())
+        literal_queries = [self.get_literals(template, q) for q in queries]
+        horizon = self.get_horizon(evidence, literal_queries)
+        rng = get_random_state(Configurator.seed)
+        dbn_filter = DBNFilter(template, Configurator.sample_size, rng, Configurator.resample_threshold)
+        dbn_filter.add_queries(literal_queries)
+        probabilities = dbn_filter.run(evidence, horizon)
+        sync_random_state(rng)
+        return probabilities
+
+    def get_belief_propagation(self, template: SliceTemplate, horizon: int) -> LoopyBeliefPropagation:
+        return LoopyBeliefPropagation(template, horizon, Configurator.damping, Configurator.tolerance,
+                                      Configurator.max_iterations)
+
+    def lbp_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """Loopy belief propagation - approximate probabilities of the queries, over the slices that affect them"""
+        template = self.get_slice_template()
+        evidence = self.get_literals(template, self.get_evidence())
+        literal_queries = [self.get_literals(template, q) for q in queries]
+        lbp = self.get_belief_propagation(template, self.get_horizon(evidence, literal_queries))
+        probabilities = lbp.query(literal_queries, evidence)
+        metrics.gauge('lbp_iterations', lbp.iterations)
+        return probabilities
+
+    def get_lbp_proposal(self) -> np.ndarray:
+        """importance sampling proposal CPTs (indexed like the compiled network), with the flooding nodes' CPTs
+        replaced by their loopy belief propagation posteriors"""
+        template = self.get_slice_template()
+        lbp = self.get_belief_propagation(template, max(v.time for v in self.V) + 1)
+        lbp.run(self.get_literals(template, self.get_evidence()))
+        flood_proposal = lbp.get_proposal()
+        proposal = self.compiled.cpt.copy()
+        for v in self.V:
+            if isinstance(v, FloodBNNode):
+                proposal[self.index[v], :2] = flood_proposal[v.time, template.vertex_index[v.element.label]]
+        return proposal
+
+    def adaptive_sample_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        """
+        Adaptive likelihood weighting - draw batches of N samples until every query's estimate is within
+        +-Configurator.epsilon with confidence 1-Configurator.delta (normal approximation, Bonferroni corrected over
+        the queries), or until the samples/time budget runs out.
+        The achieved error bounds and the number of samples are kept in self.sampling_report
+        """
+        start_time = time.time()
+        compiled_queries = self.compile_queries(queries)
+        evidence = self.get_evidence_vector()
+        z = NormalDist().inv_cdf(1 - Configurator.delta / (2 * max(1, len(queries))))
+        n_samples, total_weight, total_squared_weight = 0, 0.0, 0.0
+        match_weight = np.zeros(len(queries))  # sum(w * f), f - the sample's match (0/1, or a probability)
+        squared_weight_match = np.zeros(len(queries))  # sum(w^2 * f)
+        squared_weight_squared_match = np.zeros(len(queries))  # sum(w^2 * f^2)
+        rng = get_random_state(Configurator.seed)
+        while True:
+            batch = self.compiled.generate_samples(evidence, Configurator.sample_size, rng)
+            squared_batch = SampleStore(batch.bits, np.square(batch.weights), batch.n_nodes)
+            n_samples += len(batch)
+            total_weight += batch.total_weight()
+            total_squared_weight += squared_batch.total_weight()
+            match_weight += batch.match_weights(*compiled_queries)
+            squared_weight_match += squared_batch.match_weights(*compiled_queries)
+            squared_weight_squared_match += squared_batch.match_weights(*compiled_queries, square_matches=True)
+            ess = total_weight ** 2 / total_squared_weight if total_squared_weight > 0 else 0.0
+            if total_weight > 0:
+                p = match_weight / total_weight
+                # variance of the self-normalized estimator: sum(w^2 * (f - p)^2) / sum(w)^2
+                variance = (squared_weight_squared_match - 2 * p * squared_weight_match +
+                            np.square(p) * total_squared_weight) / total_weight ** 2
+                error_bounds = z * np.sqrt(np.maximum(variance, 0))
+            else:
+                p = error_bounds = np.full(len(queries), np.nan)
+            converged = ess >= MIN_ADAPTIVE_ESS and bool(np.all(error_bounds <= Configurator.epsilon))
+            out_of_budget = n_samples >= Configurator.max_samples or \
+                (Configurator.time_budget > 0 and time.time() - start_time >= Configurator.time_budget)
+            if converged or out_of_budget or not queries:
+                break
+        sync_random_state(rng)
+        metrics.count('samples_drawn', n_samples)
+        metrics.gauge('effective_sample_size', float(ess))
+        self.sampling_report = {'samples': n_samples,
+                                'effective_sample_size': float(ess),
+                                'error_bounds': error_bounds.tolist(),
+                                'confidence': 1 - Configurator.delta,
+                                'converged': converged,
+                                'seconds': time.time() - start_time}
+        return p.tolist()
+
+    def print_sampling_report(self):
+        report = self.sampling_report
+        print('{} samples (effective sample size {}) in {} seconds, max error {} with confidence {}{}'.format(
+              report['samples'], round(report['effective_sample_size']), rnd(report['seconds']),
+              rnd(max(report['error_bounds'] + [0])), report['confidence'],
+              '' if report['converged'] else ' - sampling budget exhausted before convergence'))
+
+    def has_shared_samples(self):
+        """whether the engine evaluates all the queries of an evidence state on the same samples"""
+        return Configurator.engine in ('gibbs', 'is') or \
+            (Configurator.engine == 'lw' and Configurator.epsilon == 0 and not Configurator.prune)
+
+    def get_posterior_key(self):
+        """canonical key of the current evidence state's query results: the evidence, the engine and its settings"""
+        evidence, seed, sample_size, sampler = self.get_samples_key()
+        settings = {'exact': (),
+                    'lbp': (Configurator.damping, Configurator.tolerance, Configurator.max_iterations),
+                    'filter': (Configurator.resample_threshold,)}.get(
+            Configurator.engine, sampler + (Configurator.rao_blackwell, Configurator.epsilon, Configurator.delta,
+                                            Configurator.max_samples, Configurator.prune))
+        return evidence, Configurator.engine, seed, sample_size, settings
+
+    def get_marginals(self) -> np.ndarray:
+        """P(node = True | evidence) of all the nodes, from the shared samples"""
+        samples = self.get_weighted_samples()
+        total_weight = samples.total_weight()
+        if total_weight == 0:
+            return np.full(self.compiled.n_nodes, np.nan)
+        return samples.marginal_weights(self.get_leaf_cpts(range(self.compiled.n_nodes))) / total_weight
+
+    def cached_queries(self, queries: List[Dict[BNNode, bool]]) -> Tuple[List[float], bool]:
+        """
+        the probabilities of the queries, from the posterior cache of the current evidence state. Only the queries
+        not in it are evaluated, and the first evaluation on shared samples caches the marginals of all the nodes
+        :return: the probabilities, and whether any query was evaluated
+        """
+        if self.posterior_cache is None:
+            with metrics.timer('inference'):
+                probabilities = self.evaluate_queries(queries)
+            metrics.count('queries_evaluated', len(queries))
+            return probabilities, True
+        key = self.get_posterior_key()
+        posterior = self.posterior_cache.get(key)
+        literal_queries = [tuple(sorted(zip(*self.get_assignment_columns(query)))) for query in queries]
+        probabilities = [None if posterior is None else posterior.get(q) for q in literal_queries]
+        missing = [k for k, probability in enumerate(probabilities) if probability is None]
+        if not missing:
+            return probabilities, False
+        with metrics.timer('inference'):
+            evaluated = self.evaluate_queries([queries[k] for k in missing])
+        metrics.count('queries_evaluated', len(missing))
+        if posterior is None:
+            posterior = Posterior(self.compiled.n_nodes)
+            if self.has_shared_samples():
+                posterior.marginals = self.get_marginals()
+        for k, probability in zip(missing, evaluated):
+            probabilities[k] = probability
+            posterior.set(literal_queries[k], probability)
+        posterior.samples = self.count_samples()
+        self.posterior_cache.put(key, posterior)
+        return probabilities, True
+
+    def print_cache_report(self):
+        print('answered from the posterior cache ({} hits, {} misses, {} evidence states)'.format(
+              self.posterior_cache.hits, self.posterior_cache.misses, len(self.posterior_cache)))
+
+    def evaluate_queries(self, queries: List[Dict[BNNode, bool]]) -> List[float]:
+        if Configurator.engine == 'exact':
+            probabilities = self.exact_queries(queries)
+        elif Configurator.engine == 'filter':
+            probabilities = self.filter_queries(queries)
+        elif Configurator.engine == 'gibbs':
+            probabilities = self.gibbs_queries(queries)
+        elif Configurator.engine == 'lbp':
+            probabilities = self.lbp_queries(queries)
+        elif Configurator.engine == 'lw' and Configurator.epsilon > 0:
+            probabilities = self.adaptive_sample_queries(queries)
+        elif Configurator.engine == 'lw' and Configurator.prune:
+            probabilities = self.pruned_sample_queries(queries)
+        else:
+            weighted_samples = self.get_weighted_samples()
+            # weighted_samples = self.filter_by_evidence(weighted_samples)  # redundant in Likelihood Weighting
+            probabilities = self.sample_many(weighted_samples, queries)
+        return probabilities
+
+    @metrics.timed('queries')
     def sample_queries(self, queries: List[Dict[BNNode, bool]], verbose=True):
-        weighted_samples = self.generate_weighted_samples()
+        metrics.count('queries', len(queries))
         evidence = self.get_evidence()
-        # weighted_samples = self.filter_by_evidence(weighted_samples)  # redundant in Likelihood Weighting
-        queries_results = [(query, evidence, self.sample(weighted_samples, query)) for query in queries]
+        probabilities, evaluated = self.cached_queries(queries)
+        queries_results = [(query, evidence, prob) for query, prob in zip(queries, probabilities)]
         if verbose:
             for query_result in queries_results:
                 self.print_query_result(query_result)
+            if not evaluated:
+                self.print_cache_report()
+            elif Configurator.engine == 'lw' and Configurator.epsilon > 0:
+                self.print_sampling_report()
+            elif Configurator.engine == 'gibbs':
+                self.print_gibbs_report()
+            elif Configurator.engine == 'is':
+                self.print_importance_sampling_report()
         return queries_results
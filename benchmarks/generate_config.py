@@ -0,0 +1,99 @@
+"""
+Synthetic graph configuration files, in the assignment's format (#N, #V, #Ppersistence and #E lines), e.g.
+python3 benchmarks/generate_config.py --kind geometric --size 1000 --output geometric_1000.config
+"""
+import math
+import random
+import argparse
+import numpy as np
+from typing import List, Tuple
+
+KINDS = ('grid', 'geometric', 'scale_free')
+MAX_WEIGHT = 4  # edge weights are 1..MAX_WEIGHT, so the blockage probabilities 0.6/w are in [0.15, 0.6]
+PAIRS_CHUNK = 1000  # vertices per chunk of the pairwise distances of the geometric graph
+
+
+def grid_graph(size: int, rng: random.Random) -> Tuple[int, List[Tuple[int, int]]]:
+    """a square grid of about size vertices, numbered row by row"""
+    side = max(1, round(math.sqrt(size)))
+    edges = []
+    for r in range(side):
+        for c in range(side):
+            v = r * side + c + 1
+            if c + 1 < side:
+                edges.append((v, v + 1))
+            if r + 1 < side:
+                edges.append((v, v + side))
+    return side * side, edges
+
+
+def geometric_graph(size: int, rng: random.Random, degree=4.0) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    random geometric graph - size points in the unit square, connected when closer than the radius of the given
+    mean degree. Every point is also connected to its nearest earlier point, so the graph is connected
+    """
+    points = np.array([(rng.random(), rng.random()) for _ in range(size)])
+    radius = math.sqrt(degree / (math.pi * max(1, size)))
+    edges = set()
+    for start in range(0, size, PAIRS_CHUNK):
+        chunk = points[start:start + PAIRS_CHUNK]
+        distances = np.sqrt(((chunk[:, None, :] - points[None, :, :]) ** 2).sum(axis=-1))
+        for k, row in enumerate(distances):
+            u = start + k
+            edges.update((int(v) + 1, u + 1) for v in np.flatnonzero(row[:u] < radius))
+            if u > 0:
+                edges.add((int(np.argmin(row[:u])) + 1, u + 1))
+    return size, sorted(edges)
+
+
+def scale_free_graph(size: int, rng: random.Random, attachments=2) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    preferential attachment (Barabasi-Albert) - every new vertex connects to `attachments` existing vertices,
+    chosen by degree: a few hubs and many low degree vertices, like a road network with junction towns
+    """
+    edges = []
+    endpoints = [1]  # every vertex appears once per incident edge (and the first one once)
+    for v in range(2, size + 1):
+        targets = {rng.choice(endpoints) for _ in range(min(attachments, v - 1))}
+        for u in sorted(targets):
+            edges.append((u, v))
+            endpoints.extend((u, v))
+    return size, edges
+
+
+def write_config(path: str, n_vertices: int, edges: List[Tuple[int, int]], rng: random.Random,
+                 flood_fraction=0.2, persistence=0.9):
+    """
+    :param flood_fraction: fraction of the vertices with a positive flooding probability at t=0 (the rest are 0)
+    """
+    with open(path, 'w') as f:
+        f.write('#N {}\n'.format(n_vertices))
+        for v in range(1, n_vertices + 1):
+            chance = rng.uniform(0.05, 0.4) if rng.random() < flood_fraction else 0
+            f.write('#V{} F {:.2f}\n'.format(v, chance))
+        f.write('#Ppersistence {}\n'.format(persistence))
+        for i, (v1, v2) in enumerate(edges, 1):
+            f.write('#E{} {} {} W{}\n'.format(i, v1, v2, rng.randint(1, MAX_WEIGHT)))
+
+
+def generate_config(path: str, kind: str, size: int, seed=0, flood_fraction=0.2, persistence=0.9) -> str:
+    """write a configuration file of a synthetic graph of about size vertices, :return: the path"""
+    rng = random.Random(seed)
+    generators = {'grid': grid_graph, 'geometric': geometric_graph, 'scale_free': scale_free_graph}
+    n_vertices, edges = generators[kind](size, rng)
+    write_config(path, n_vertices, edges, rng, flood_fraction, persistence)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate a synthetic graph configuration file')
+    parser.add_argument('--kind',           default='grid', choices=KINDS, help='graph type')
+    parser.add_argument('--size',           default=100,    type=int,      help='number of vertices (grids are rounded '
+                                                                                'to a square)')
+    parser.add_argument('--seed',           default=0,      type=int,      help='random seed')
+    parser.add_argument('--flood_fraction', default=0.2,    type=float,    help='fraction of the vertices that may '
+                                                                                'flood at t=0')
+    parser.add_argument('--persistence',    default=0.9,    type=float,    help='flooding persistence probability')
+    parser.add_argument('--output',         required=True,                 help='configuration file path')
+    args = parser.parse_args()
+    generate_config(args.output, args.kind, args.size, args.seed, args.flood_fraction, args.persistence)
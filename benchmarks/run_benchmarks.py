@@ -0,0 +1,238 @@
+"""
+Benchmark suite - sweeps graph kind, |V|, T, N, evidence density and engine over synthetic graphs, and writes the
+measurements as JSON, so runs can be compared over time, e.g.
+python3 benchmarks/run_benchmarks.py --sizes 25,100,400 -T 2,4 -N 1000,10000 --evidence 0,0.05 --output run.json
+Every case runs in its own process, so its peak RSS is its own.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import itertools
+import contextlib
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from generate_config import generate_config, KINDS  # noqa: E402
+
+IMPORT_SCRIPT = 'import time, resource; start_time = time.perf_counter(); import hurricane_simulator; ' \
+                'print(time.perf_counter() - start_time, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)'
+
+
+def get_peak_rss_mb() -> float:
+    """peak resident set size of this process (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def configure(graph_path: str, T: int, N: int, seed: int, engine='lw'):
+    """set the user configuration, as the command line would (with the query results cache disabled)"""
+    from configurator import Configurator
+    sys.argv = ['test.py', '-g', graph_path, '-T', str(T), '-N', str(N), '-s', str(seed), '-e', engine,
+                '--cache_size', '0']
+    with contextlib.redirect_stdout(io.StringIO()):
+        Configurator.get_user_config()
+    return Configurator
+
+
+def get_evidence(BN, density: float, seed: int) -> List:
+    """
+    observations of a fraction of the blockage nodes, with the values of one world sampled from the network
+    (so the evidence is always possible)
+    """
+    from compiled_network import UNASSIGNED_VALUE
+    rng = np.random.RandomState(seed)
+    network = BN.compiled
+    X, _ = network.likelihood_weighting(np.full(network.n_nodes, UNASSIGNED_VALUE, dtype=np.int64), 1, rng)
+    blockages = np.flatnonzero(network.is_leaf)
+    observed = rng.choice(blockages, int(round(density * len(blockages))), replace=False)
+    return [(BN.top_sorted_V[i], bool(X[0, i])) for i in sorted(observed)]
+
+
+def get_path_endpoints(sim, hops: int):
+    """V1, and the first vertex at (up to) the given number of hops from it"""
+    from path_search import get_hop_distances
+    vertices = {v.label: v for v in sim.G.get_vertices()}
+    distances = get_hop_distances(sim.G, vertices['V1'])
+    hops = min(hops, max(distances.values()))
+    tgt = next(v for v in sim.G.get_vertices() if distances.get(v) == hops)
+    return 'V1', tgt.label, hops
+
+
+def run_case(case: Dict) -> Dict:
+    """
+    one benchmark case: parsing, sampling, the flooding marginals of all the free vertices at all times,
+    a best path query, and the error of the marginals against variable elimination (on small graphs)
+    """
+    Configurator = configure(case['graph_path'], case['T'], case['N'], case['seed'], case['engine'])
+    from hurricane_simulator import Simulator
+    from bayes_network import FloodBNNode, UNASSIGNED
+    result = {k: v for k, v in case.items() if k != 'graph_path'}
+    start_time = time.perf_counter()
+    sim = Simulator()
+    BN = sim.BN
+    result.update(parse_seconds=time.perf_counter() - start_time, vertices=len(sim.G.get_vertices()),
+                  edges=len(sim.G.get_edges()), nodes=BN.compiled.n_nodes)
+    for bn_node, value in get_evidence(BN, case['evidence'], case['seed']):
+        BN.add_evidence(bn_node, value)
+    result['evidence_nodes'] = len(BN.get_evidence())
+
+    if case['engine'] in ('lw', 'gibbs', 'is'):
+        start_time = time.perf_counter()
+        samples = BN.generate_weighted_samples()
+        seconds = time.perf_counter() - start_time
+        result.update(sampling_seconds=seconds, samples_per_second=len(samples) / seconds if seconds else None,
+                      effective_sample_size=float(samples.effective_sample_size()))
+
+    queries = [{v: True} for v in BN.top_sorted_V if isinstance(v, FloodBNNode) and v.value is UNASSIGNED]
+    start_time = time.perf_counter()
+    estimates = np.array([p for _, _, p in BN.sample_queries(queries, verbose=False)])
+    result.update(queries=len(queries), query_seconds=time.perf_counter() - start_time)
+
+    src, tgt, hops = get_path_endpoints(sim, case['path_hops'])
+    start_time = time.perf_counter()
+    paths = sim.get_best_free_paths(src, tgt, 0, 1, hops + 2)
+    result.update(best_path_seconds=time.perf_counter() - start_time, best_path_hops=hops,
+                  best_path_probability=paths[0][1] if paths else None)
+
+    if result['vertices'] <= case['exact_limit'] and queries:
+        Configurator.engine, Configurator.prune = 'exact', True
+        start_time = time.perf_counter()
+        exact = np.array([p for _, _, p in BN.sample_queries(queries, verbose=False)])
+        errors = np.abs(estimates - exact)
+        result.update(exact_seconds=time.perf_counter() - start_time, max_error=float(np.nanmax(errors)),
+                      mean_error=float(np.nanmean(errors)))
+    result['peak_rss_mb'] = get_peak_rss_mb()
+    return result
+
+
+def run_data_structures(case: Dict) -> Dict:
+    """
+    the pure Python structures on a large graph: building the Bayes Network DAG, sorting it topologically,
+    compiling it, Dijkstra on the road graph, and the memory the parsed graph and network take
+    """
+    configure(case['graph_path'], case['T'], 1, 1)
+    from hurricane_simulator import Simulator
+    from compiled_network import CompiledNetwork
+    result = {k: v for k, v in case.items() if k != 'graph_path'}
+    start_time = time.perf_counter()
+    sim = Simulator()
+    result.update(parse_seconds=time.perf_counter() - start_time, vertices=len(sim.G.get_vertices()),
+                  nodes=len(sim.BN.V))
+    sim.BN.G = None  # built again below
+    start_time = time.perf_counter()
+    dag = sim.BN.get_dag()
+    result['dag_seconds'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    order = dag.topological_sort()
+    result['topological_sort_seconds'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    CompiledNetwork.from_nodes(order)
+    result['compile_seconds'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    sim.G.dijkstra(next(iter(sim.G.get_vertices())))
+    result['dijkstra_seconds'] = time.perf_counter() - start_time
+    del sim, dag, order
+    tracemalloc.start()
+    sim = Simulator()
+    result['graph_memory_mb'] = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    result['peak_rss_mb'] = get_peak_rss_mb()
+    return result
+
+
+def benchmark_import(repeats=3) -> Dict:
+    """the time and memory of importing the simulator in a fresh interpreter (best of repeats)"""
+    runs = [subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPO_DIR, capture_output=True, text=True,
+                           check=True).stdout.split() for _ in range(repeats)]
+    return {'seconds': min(float(seconds) for seconds, _ in runs),
+            'peak_rss_mb': min(float(rss) for _, rss in runs)}
+
+
+def run_in_process(mode: str, case: Dict, timeout: float) -> Dict:
+    """run a case in a fresh interpreter. :return: its results, or the case with an error"""
+    try:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), mode, json.dumps(case)], cwd=REPO_DIR,
+                                 capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return dict(case, error='timeout after {} seconds'.format(timeout))
+    if process.returncode != 0:
+        return dict(case, error=process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'failed')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def get_environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def get_list(values: str, cast):
+    return [cast(v) for v in values.split(',') if v]
+
+
+def run_benchmarks(args) -> Dict:
+    results = {'environment': get_environment(), 'import': benchmark_import(), 'data_structures': [], 'cases': []}
+    with tempfile.TemporaryDirectory() as config_dir:
+        def get_config(kind, size):
+            path = os.path.join(config_dir, '{}_{}.config'.format(kind, size))
+            return path if os.path.exists(path) else generate_config(path, kind, size, args.seed)
+
+        for size in get_list(args.large_sizes, int):
+            case = {'kind': 'grid', 'size': size, 'T': args.large_T, 'graph_path': get_config('grid', size)}
+            results['data_structures'].append(run_in_process('--data_structures', case, args.timeout))
+            print(json.dumps(results['data_structures'][-1]), file=sys.stderr)
+        sweep = itertools.product(get_list(args.kinds, str), get_list(args.sizes, int), get_list(args.T, int),
+                                  get_list(args.N, int), get_list(args.evidence, float), get_list(args.engines, str))
+        for kind, size, T, N, evidence, engine in sweep:
+            case = {'kind': kind, 'size': size, 'T': T, 'N': N, 'evidence': evidence, 'engine': engine,
+                    'seed': args.seed, 'path_hops': args.path_hops, 'exact_limit': args.exact_limit,
+                    'graph_path': get_config(kind, size)}
+            results['cases'].append(run_in_process('--case', case, args.timeout))
+            print(json.dumps(results['cases'][-1]), file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] in ('--case', '--data_structures'):  # a single case, in its own process
+        run = run_case if sys.argv[1] == '--case' else run_data_structures
+        print(json.dumps(run(json.loads(sys.argv[2]))))
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description='benchmark suite over synthetic graphs, with JSON output')
+    parser.add_argument('--kinds',       default='grid',          help='comma separated graph types ({})'.format(
+                                                                       ', '.join(KINDS)))
+    parser.add_argument('--sizes',       default='25,100,400',    help='comma separated numbers of vertices')
+    parser.add_argument('-T',            default='2,4',           help='comma separated numbers of time units')
+    parser.add_argument('-N',            default='1000,10000',    help='comma separated sample sizes')
+    parser.add_argument('--evidence',    default='0,0.05',        help='comma separated fractions of the blockage '
+                                                                       'nodes observed')
+    parser.add_argument('--engines',     default='lw',            help='comma separated inference engines')
+    parser.add_argument('--seed',        default=1,     type=int, help='random seed of the graphs, the evidence and '
+                                                                       'the sampling')
+    parser.add_argument('--path_hops',   default=6,     type=int, help='best path query: hops between the endpoints')
+    parser.add_argument('--exact_limit', default=25,    type=int, help='largest number of vertices to compute the '
+                                                                       'estimators error against variable '
+                                                                       'elimination for')
+    parser.add_argument('--large_sizes', default='2500',          help='comma separated numbers of vertices of the '
+                                                                       'large grids for the data structures '
+                                                                       'benchmark (empty - skip)')
+    parser.add_argument('--large_T',     default=10,    type=int, help='number of time units of the large grids')
+    parser.add_argument('--timeout',     default=600,   type=float, help='seconds limit of every case')
+    parser.add_argument('--output',      default='',              help='JSON results file (empty - standard output)')
+    args = parser.parse_args()
+    results = run_benchmarks(args)
+    with (open(args.output, 'w') if args.output else contextlib.nullcontext(sys.stdout)) as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
@@ -0,0 +1,273 @@
+import os
+import json
+import random
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from typing import List, Tuple, Union
+from sample_store import SampleStore
+
+UNASSIGNED_VALUE = -1  # evidence vector entry of a non-evidence node
+SAMPLING_CHUNK_BYTES = 2 ** 24  # max size of an unpacked samples matrix
+SNAPSHOT_VERSION = 2  # bump when the network construction changes, to invalidate existing snapshots
+SNAPSHOT_ARRAYS = ('labels', 'n_parents', 'parents', 'cpt', 'depth')
+
+
+def get_random_state(seed=0) -> np.random.RandomState:
+    """
+    numpy generator that continues the `random` module's Mersenne-Twister stream.
+    random.random() and RandomState.random_sample() share the same 53-bit construction, so drawing
+    from this generator yields exactly the numbers the per-sample loop would have drawn.
+    """
+    if seed != 0:
+        random.seed(seed)
+    _, internal_state, _ = random.getstate()
+    rng = np.random.RandomState()
+    rng.set_state(('MT19937', np.array(internal_state[:-1], dtype=np.uint32), internal_state[-1]))
+    return rng
+
+
+def sync_random_state(rng: np.random.RandomState):
+    """write the numpy generator state back to the `random` module, so later draws continue the stream"""
+    version, _, gauss_next = random.getstate()
+    _, key, pos = rng.get_state()[:3]
+    random.setstate((version, tuple(int(k) for k in key) + (pos,), gauss_next))
+
+
+class CompiledNetwork:
+    """
+    Immutable array form of a Bayes Network, used for vectorized inference.
+    Nodes are identified by their position in the topological order, so every parent index is smaller than its child's.
+    cpt[i, a] is P(node i = True | parents assignment a), where a is the binary encoding of the parents' values
+    (first parent is the most significant bit).
+    The arrays are read-only, so one compiled network can be shared by threads, and it is picklable for processes.
+    """
+    def __init__(self, labels: List[str], n_parents: np.ndarray, parents: np.ndarray, cpt: np.ndarray,
+                 depth: np.ndarray = None):
+        """
+        :param n_parents: number of parents of each node
+        :param parents: (n_nodes x max parents) parents indices of each node, padded with -1
+        :param cpt: (n_nodes x 2^max parents) P(node = True | parents assignment)
+        :param depth: the longest path from a root to each node (computed if not given, e.g. by a snapshot)
+        """
+        self.n_nodes = len(labels)
+        self.labels: Tuple[str, ...] = tuple(labels)
+        self.n_parents = n_parents
+        self.parents = parents
+        self.cpt = cpt
+        self.depth = self.get_depth() if depth is None else depth
+        self.layers: Tuple[np.ndarray, ...] = tuple(self.get_layers())
+        self.is_leaf = ~np.isin(np.arange(self.n_nodes), parents)  # nodes without children
+        # the children of node i are children[child_offsets[i]:child_offsets[i + 1]]
+        self.child_offsets, self.children = self.get_children()
+        for array in (self.n_parents, self.parents, self.cpt, self.depth, self.is_leaf, self.child_offsets,
+                      self.children) + self.layers:
+            array.setflags(write=False)
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError('{} is immutable'.format(self.__class__.__name__))
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def from_nodes(top_sorted_V: List):
+        """compile Bayes Network nodes, given in topological order"""
+        n = len(top_sorted_V)
+        index = {v: i for i, v in enumerate(top_sorted_V)}
+        max_parents = max([len(v.parents) for v in top_sorted_V] + [0])
+        n_parents = np.array([len(v.parents) for v in top_sorted_V], dtype=np.int64)
+        parents = np.full((n, max_parents), -1, dtype=np.int64)
+        cpt = np.zeros((n, 2 ** max_parents), dtype=np.float64)
+        for i, v in enumerate(top_sorted_V):
+            node_parents = [index[p] for p in v.parents]
+            node_cpt = v.get_cpt()
+            parents[i, :len(node_parents)] = node_parents
+            cpt[i, :len(node_cpt)] = node_cpt
+        return CompiledNetwork([str(v) for v in top_sorted_V], n_parents, parents, cpt)
+
+    def get_depth(self) -> np.ndarray:
+        """the depth of every node, in a single pass in topological order (every parent precedes its children)"""
+        depth = [0] * self.n_nodes
+        for i, node_parents in enumerate(self.parents.tolist()):
+            for p in node_parents:
+                if p >= 0 and depth[p] >= depth[i]:
+                    depth[i] = depth[p] + 1
+        return np.array(depth, dtype=np.int64)
+
+    def get_layers(self):
+        """group the nodes by depth - nodes of the same layer don't depend on each other"""
+        if not self.n_nodes:
+            return []
+        order = np.argsort(self.depth, kind='stable')  # ascending node indices within every layer
+        boundaries = np.searchsorted(self.depth[order], np.arange(1, self.depth.max() + 1))
+        return np.split(order, boundaries)
+
+    def get_children(self) -> Tuple[np.ndarray, np.ndarray]:
+        """the children of all the nodes, grouped by parent: (offset of each node's group, the children)"""
+        children, k = np.nonzero(self.parents >= 0)
+        parent = self.parents[children, k]
+        order = np.argsort(parent, kind='stable')
+        offsets = np.searchsorted(parent[order], np.arange(self.n_nodes + 1))
+        return offsets.astype(np.int64), children[order].astype(np.int64)
+
+    def get_requisite_nodes(self, query_nodes, evidence: np.ndarray) -> np.ndarray:
+        """
+        Relevance pruning by Bayes-ball (Shachter 1998) - the nodes needed to compute P(query | evidence).
+        A ball bounces from the query nodes along the active trails: an unobserved node passes it on to its parents
+        (if it came from a child) and to its children, an observed node bounces it back to its parents (if it came
+        from a parent). The CPTs needed are those of the nodes the ball passed to their parents, and the observations
+        needed are those it visited. Barren nodes, and nodes d-separated from the query by the evidence, aren't needed.
+        Only the nodes the ball reaches are visited.
+        :param evidence: int array over the nodes - UNASSIGNED_VALUE, or the observed 0/1 value
+        :return: the requisite nodes, in topological order
+        """
+        observed = evidence != UNASSIGNED_VALUE
+        top = np.zeros(self.n_nodes, dtype=bool)  # the ball was passed to the node's parents
+        bottom = np.zeros(self.n_nodes, dtype=bool)  # the ball was passed to the node's children
+        visited = np.zeros(self.n_nodes, dtype=bool)
+        schedule = [(int(v), True) for v in query_nodes]  # (node, whether the ball comes from a child)
+        while schedule:
+            v, from_child = schedule.pop()
+            visited[v] = True
+            if not top[v] and (observed[v] != from_child):
+                top[v] = True
+                schedule.extend((int(p), True) for p in self.parents[v, :self.n_parents[v]])
+            if not bottom[v] and not observed[v]:
+                bottom[v] = True
+                schedule.extend((int(c), False) for c in self.children[self.child_offsets[v]:self.child_offsets[v + 1]])
+        return np.flatnonzero(top | (visited & observed))
+
+    def subnetwork(self, nodes: np.ndarray, evidence: np.ndarray) -> 'CompiledNetwork':
+        """
+        the network over a subset of the nodes, numbered by their order in it (e.g. the requisite nodes).
+        The nodes must have all their parents in the subset, except observed nodes, which become roots fixed at
+        their observed value (the ball doesn't pass through them, so their CPTs aren't needed)
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        position = np.full(self.n_nodes, -1, dtype=np.int64)
+        position[nodes] = np.arange(len(nodes))
+        parents = self.parents[nodes]
+        has_parent = parents >= 0
+        parents = np.where(has_parent, position[np.where(has_parent, parents, 0)], -1)
+        complete = ~(has_parent & (parents < 0)).any(axis=1)
+        node_evidence = evidence[nodes]
+        if not (complete | (node_evidence != UNASSIGNED_VALUE)).all():
+            raise ValueError('the subnetwork is missing parents of unobserved nodes')
+        n_parents = np.where(complete, self.n_parents[nodes], 0)
+        parents = np.where(complete[:, None], parents, -1)
+        cpt = np.where(complete[:, None], self.cpt[nodes], node_evidence[:, None].astype(np.float64))
+        return CompiledNetwork([self.labels[i] for i in nodes], n_parents, parents, cpt)
+
+    @staticmethod
+    def get_snapshot_path(snapshot_dir: str, config_path: str, T: int) -> str:
+        """the snapshot directory of a graph configuration file and a number of time units"""
+        digest = hashlib.sha1()
+        with open(config_path, 'rb') as f:
+            digest.update(f.read())
+        digest.update('T={} version={}'.format(T, SNAPSHOT_VERSION).encode())
+        return os.path.join(snapshot_dir, digest.hexdigest())
+
+    def save(self, path: str):
+        """
+        write the network's arrays as .npy files in a snapshot directory.
+        The directory is written aside and renamed into place, so concurrent runs never see a partial snapshot
+        """
+        parent_dir = os.path.dirname(path) or '.'
+        os.makedirs(parent_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=parent_dir)
+        np.save(os.path.join(temp_dir, 'labels.npy'), np.array(self.labels, dtype=str))
+        for name in SNAPSHOT_ARRAYS[1:]:
+            np.save(os.path.join(temp_dir, name + '.npy'), getattr(self, name))
+        with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'n_nodes': self.n_nodes}, f)
+        try:
+            os.rename(temp_dir, path)
+        except OSError:  # another run saved it first
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def load(path: str) -> Union['CompiledNetwork', None]:
+        """:return: the network of a snapshot directory, memory-mapped - or None if there is no valid snapshot"""
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                if json.load(f).get('version') != SNAPSHOT_VERSION:
+                    return None
+            arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in SNAPSHOT_ARRAYS]
+        except (OSError, ValueError):
+            return None
+        labels, n_parents, parents, cpt, depth = arrays
+        return CompiledNetwork(labels.tolist(), n_parents, parents, cpt, depth)
+
+    def get_parents_assignment(self, X: np.ndarray, nodes: np.ndarray):
+        """
+        binary encoding of the parents' values of each node in nodes, for every sample
+        :param X: (n_nodes x n_samples) node-major samples matrix
+        :return: (len(nodes) x n_samples) parents assignments
+        """
+        assignment = np.zeros((len(nodes), X.shape[1]), dtype=np.int64)
+        for k in range(self.parents.shape[1]):
+            parent = self.parents[nodes, k]
+            has_parent = parent >= 0
+            if not has_parent.any():
+                break
+            parent_values = X[np.where(has_parent, parent, 0)]
+            assignment = np.where(has_parent[:, None], assignment * 2 + parent_values, assignment)
+        return assignment
+
+    def likelihood_weighting(self, evidence: np.ndarray, n_samples: int, rng: np.random.RandomState,
+                             proposal: np.ndarray = None):
+        """
+        Weighted likelihood sampling - generate all samples at once, one topological layer at a time.
+        Random numbers are drawn sample by sample in topological order, same as sampling each sample separately.
+        The work is done on node-major (transposed) matrices, so a layer's nodes are contiguous rows.
+        :param evidence: int array over the nodes - UNASSIGNED_VALUE, or the observed 0/1 value
+        :param proposal: importance sampling - CPTs (indexed like cpt) to sample the free nodes from instead of
+                         their own CPTs. The weights are corrected by P(value | parents) / proposal(value | parents)
+        :return: (n_samples x n_nodes) boolean samples matrix and the samples' weights
+        """
+        is_free = evidence == UNASSIGNED_VALUE
+        free_row = np.cumsum(is_free) - 1
+        evidence_row = np.cumsum(~is_free) - 1
+        U = np.ascontiguousarray(rng.random_sample((n_samples, int(is_free.sum()))).T)
+        X = np.zeros((self.n_nodes, n_samples), dtype=bool)
+        evidence_probs = np.ones((int((~is_free).sum()), n_samples), dtype=np.float64)
+        weights = np.ones(n_samples, dtype=np.float64)
+        for layer in self.layers:
+            assignment = self.get_parents_assignment(X, layer)
+            probs = self.cpt[layer[:, None], assignment]
+            free = is_free[layer]
+            if proposal is None:
+                X[layer[free]] = U[free_row[layer[free]]] < probs[free]
+            else:
+                proposal_probs = proposal[layer[free][:, None], assignment[free]]
+                values = U[free_row[layer[free]]] < proposal_probs
+                X[layer[free]] = values
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ratios = np.where(values, probs[free] / proposal_probs, (1 - probs[free]) / (1 - proposal_probs))
+                weights *= ratios.prod(axis=0)
+            observed = layer[~free]
+            observed_probs = probs[~free]
+            X[observed] = evidence[observed, None].astype(bool)
+            evidence_probs[evidence_row[observed]] = np.where(evidence[observed, None] == 1,
+                                                             observed_probs, 1 - observed_probs)
+        # multiply in topological order, to get the exact same weights as the per-sample computation
+        for j in range(evidence_probs.shape[0]):
+            weights *= evidence_probs[j]
+        return X.T, weights
+
+    def generate_samples(self, evidence: np.ndarray, n_samples: int, rng: np.random.RandomState,
+                         proposal: np.ndarray = None) -> SampleStore:
+        """
+        likelihood weighting (or importance sampling from a proposal) into a bit-packed sample store.
+        Sampling in chunks keeps the unpacked matrix small. The random stream is consumed sample by sample,
+        so chunking doesn't change the samples
+        """
+        chunk_size = max(1, SAMPLING_CHUNK_BYTES // max(1, self.n_nodes))
+        chunks = [SampleStore.from_matrix(np.zeros((0, self.n_nodes), dtype=bool), np.zeros(0))]
+        for start in range(0, n_samples, chunk_size):
+            chunks.append(SampleStore.from_matrix(*self.likelihood_weighting(evidence,
+                                                                             min(chunk_size, n_samples - start),
+                                                                             rng, proposal)))
+        return SampleStore.concatenate(chunks)
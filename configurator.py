@@ -12,7 +12,85 @@ class Configurator:
         parser.add_argument('-T', type=int,          default=2,                          help='nubmer of time units for the Bayes Network')
         parser.add_argument('-N', '--sample_size',   default=1000,  type=int,            help='nubmer of samples used for the Bayes Network sampling')
         parser.add_argument('-s', '--seed',          default=0,     type=int,            help='random seed for the sampling. Used for debugging')
+        parser.add_argument('--rao_blackwell',       default=False, action='store_true',
+                            help='sampling: estimate edge blockage/free path queries by their probability given '
+                                 'the sampled flooding, instead of the sampled blockages')
+        parser.add_argument('--epsilon',             default=0,     type=float,
+                            help='adaptive sampling: draw batches of N samples until every queried probability is '
+                                 'within +-epsilon (0 - a single batch)')
+        parser.add_argument('--delta',               default=0.05,  type=float,
+                            help='adaptive sampling: the error bound holds with confidence 1-delta')
+        parser.add_argument('--max_samples',         default=10**7, type=int,
+                            help='adaptive sampling: samples budget')
+        parser.add_argument('--time_budget',         default=0,     type=float,
+                            help='adaptive sampling: time budget in seconds (0 - no limit)')
+        parser.add_argument('-w', '--workers',       default=1,     type=int,
+                            help='number of processes for likelihood weighting sampling (server mode - number of '
+                                 'server processes)')
+        parser.add_argument('--top_paths',           default=1,     type=int,
+                            help='best path query: number of most probable paths to report')
+        parser.add_argument('--max_hops',            default=0,     type=int,
+                            help='best path query: maximal number of edges in a path (0 - unlimited)')
+        parser.add_argument('--snapshot_dir',        default='',
+                            help='directory of compiled network snapshots, keyed by the graph file and T - '
+                                 'later runs on the same graph load the network from it (empty - disabled)')
+        parser.add_argument('--batch',               default='',
+                            help='batch mode: JSON lines file of scenarios (evidence and queries) to evaluate, '
+                                 'instead of the interactive menu')
+        parser.add_argument('--output',              default='',
+                            help='batch mode: JSON lines results file (empty - standard output)')
+        parser.add_argument('--prune',               default=False, action='store_true',
+                            help='relevance pruning: sample (lw) or eliminate (exact) only the nodes needed for the '
+                                 'queries given the evidence')
+        parser.add_argument('--cache_size',          default=64.0,  type=float,
+                            help='size limit (MB) of the query results cache of the evidence states seen so far, '
+                                 'least recently used evicted first (0 - disabled)')
+        parser.add_argument('--serve',               default=False, action='store_true',
+                            help='server mode: answer batch mode scenarios (JSON lines) over TCP, with WORKERS '
+                                 'processes')
+        parser.add_argument('--load_test',           default=0,     type=int,
+                            help='send this many requests (the scenarios of the batch file) to a running server, '
+                                 'and report the latency and throughput')
+        parser.add_argument('--host',                default='127.0.0.1',
+                            help='server mode: address of the server')
+        parser.add_argument('--port',                default=8765,  type=int,
+                            help='server mode: port of the server')
+        parser.add_argument('--coalesce_window',     default=0.005, type=float,
+                            help='server mode: minimal seconds a job waits for more requests with the same '
+                                 'evidence')
+        parser.add_argument('--concurrency',         default=16,    type=int,
+                            help='load test: number of concurrent connections')
+        parser.add_argument('--profile',             default='',
+                            help='run under cProfile, and write a report of the phase timers, counters and the '
+                                 'slowest functions to this file (empty - disabled)')
         parser.add_argument('-c',  '--compact',      default=False, action='store_true', help='print a short version of probabilities as a table')
+        parser.add_argument('-e', '--engine',        default='lw',
+                            choices=['lw', 'exact', 'filter', 'gibbs', 'is', 'lbp'],
+                            help='inference engine: likelihood weighting sampling (lw), variable elimination (exact), '
+                                 'slice by slice particle filtering (filter), Gibbs sampling (gibbs), adaptive '
+                                 'importance sampling (is) or loopy belief propagation (lbp)')
+        parser.add_argument('--ess_threshold',       default=0.1,   type=float,
+                            help='streamed evidence: regenerate the samples when their effective sample size falls '
+                                 'below this fraction of the sample size')
+        parser.add_argument('--burn_in',             default=100,   type=int,
+                            help='Gibbs sampling: number of sweeps discarded at the beginning of each chain')
+        parser.add_argument('--thin',                default=1,     type=int,
+                            help='Gibbs sampling: keep every thin-th sweep of the chains')
+        parser.add_argument('--chains',              default=4,     type=int,
+                            help='Gibbs sampling: number of chains, the N samples are split between them')
+        parser.add_argument('--learning_batches',    default=10,    type=int,
+                            help='importance sampling: number of batches (of N/learning_batches samples, at least '
+                                 '1000) the proposal is learned from')
+        parser.add_argument('--lbp_proposal',        default=False, action='store_true',
+                            help='importance sampling: initialize the proposal from loopy belief propagation')
+        parser.add_argument('--damping',             default=0.3,   type=float,
+                            help='loopy belief propagation: fraction of the previous message kept in every update')
+        parser.add_argument('--tolerance',           default=1e-6,  type=float,
+                            help='loopy belief propagation: stop when no message changes by more than this')
+        parser.add_argument('--max_iterations',      default=200,   type=int,
+                            help='loopy belief propagation: iterations budget')
+        parser.add_argument('--resample_threshold',  default=0.5,   type=float,
+                            help='particle filter resampling threshold, as a fraction of the sample size')
 
         args = vars(parser.parse_args())
         for k, v in args.items():
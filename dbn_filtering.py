@@ -0,0 +1,147 @@
+import numpy as np
+from typing import List, Dict, Tuple
+
+# a literal of a query or an evidence: (time, is edge, vertex/edge index, value)
+Literal = Tuple[int, bool, int, bool]
+
+
+class SliceTemplate:
+    """
+    A single time slice of the Dynamic Bayes Network. Every slice has the same structure:
+    Fl(v,t) depends on Fl(v,t-1) only, and B(e,t) depends on the flooding of e's vertices at time t.
+    """
+    def __init__(self,
+                 vertex_labels: List[str],
+                 flood_cpt: np.ndarray,
+                 edge_labels: List[str],
+                 edge_vertices: np.ndarray,
+                 edge_cpt: np.ndarray):
+        """
+        :param flood_cpt: (|V| x 3) P(Fl(v,0)), P(Fl(v,t) | ~Fl(v,t-1)), P(Fl(v,t) | Fl(v,t-1))
+        :param edge_vertices: (|E| x 2) indices of each edge's vertices
+        :param edge_cpt: (|E| x 4) P(B(e,t) | flooding of e's vertices), indexed by 2 * Fl(v1,t) + Fl(v2,t)
+        """
+        self.vertex_labels = vertex_labels
+        self.flood_cpt = flood_cpt
+        self.edge_labels = edge_labels
+        self.edge_vertices = edge_vertices
+        self.edge_cpt = edge_cpt
+        self.vertex_index = {label: i for i, label in enumerate(vertex_labels)}
+        self.edge_index = {label: i for i, label in enumerate(edge_labels)}
+
+    def get_literal(self, label: str, t: int, value: bool) -> Literal:
+        is_edge = label in self.edge_index
+        return t, is_edge, (self.edge_index if is_edge else self.vertex_index)[label], bool(value)
+
+
+class DBNFilter:
+    """
+    Slice by slice likelihood weighting (a particle filter) over the DBN.
+    Only the particles' flooding state of the current slice is kept, so memory doesn't depend on the horizon,
+    and the filter can always be advanced by another slice.
+    Queries about past slices are tracked by a per-particle indicator that follows the particles when they are
+    resampled, so the estimates are conditioned on all the evidence (including later evidence).
+    """
+    def __init__(self, template: SliceTemplate, n_particles: int, rng: np.random.RandomState,
+                 resample_threshold=0.5):
+        """:param resample_threshold: resample when the effective sample size falls below this fraction of N"""
+        self.template = template
+        self.n_particles = n_particles
+        self.rng = rng
+        self.resample_threshold = resample_threshold
+        self.t = 0  # the next slice to sample
+        self.flooded = np.zeros((n_particles, len(template.vertex_labels)), dtype=bool)
+        self.weights = np.full(n_particles, 1 / n_particles)  # normalized
+        self.log_likelihood = 0.0  # log P(evidence so far)
+        self.queries: List[List[Literal]] = []
+        self.indicators = np.zeros((0, n_particles), dtype=bool)  # does each particle satisfy each query
+        self.n_resamples = 0
+
+    def add_queries(self, queries: List[List[Literal]]):
+        """track queries. Literals of slices that were already sampled are ignored"""
+        self.queries.extend(queries)
+        self.indicators = np.vstack([self.indicators, np.ones((len(queries), self.n_particles), dtype=bool)])
+
+    def effective_sample_size(self):
+        return 1 / np.square(self.weights).sum()
+
+    def advance(self, evidence: Dict[Tuple[bool, int], bool]):
+        """
+        sample the next time slice
+        :param evidence: {(is edge, vertex/edge index): value} observed at the new slice
+        """
+        t = self.t
+        cpt = self.template.flood_cpt
+        if t == 0:
+            flood_probs = np.broadcast_to(cpt[:, 0], self.flooded.shape)
+        else:
+            flood_probs = np.where(self.flooded, cpt[:, 2], cpt[:, 1])
+        self.flooded = self.rng.random_sample(self.flooded.shape) < flood_probs
+        likelihood = np.ones(self.n_particles)
+        # the flooding observations are clamped first, so the edges' likelihoods are given the observed flooding
+        for (is_edge, i), value in evidence.items():
+            if not is_edge:
+                p = flood_probs[:, i]
+                self.flooded[:, i] = value
+                likelihood *= p if value else 1 - p
+        edges_values: Dict[int, np.ndarray] = {}
+        for (is_edge, i), value in evidence.items():
+            if is_edge:
+                p = self.get_edges_probabilities([i])[:, 0]
+                edges_values[i] = np.full(self.n_particles, bool(value))
+                likelihood *= p if value else 1 - p
+        self.update_queries(t, edges_values)
+        self.reweight(likelihood)
+        self.t += 1
+
+    def get_edges_probabilities(self, edges) -> np.ndarray:
+        """(N x len(edges)) probability of each edge to be blocked, given the particles' flooding"""
+        edges = np.asarray(edges, dtype=np.int64)
+        v1, v2 = self.template.edge_vertices[edges, 0], self.template.edge_vertices[edges, 1]
+        return self.template.edge_cpt[edges, 2 * self.flooded[:, v1] + self.flooded[:, v2]]
+
+    def update_queries(self, t, edges_values: Dict[int, np.ndarray]):
+        """evaluate the queries' literals of slice t. Unobserved edges are sampled once, for all the queries"""
+        literals = [(q, literal) for q, query in enumerate(self.queries) for literal in query if literal[0] == t]
+        sampled_edges = sorted({i for _, (_, is_edge, i, _) in literals if is_edge and i not in edges_values})
+        if sampled_edges:
+            blocked = self.rng.random_sample((self.n_particles, len(sampled_edges))) < \
+                      self.get_edges_probabilities(sampled_edges)
+            for j, i in enumerate(sampled_edges):
+                edges_values[i] = blocked[:, j]
+        for q, (_, is_edge, i, value) in literals:
+            values = edges_values[i] if is_edge else self.flooded[:, i]
+            self.indicators[q] &= values == value
+
+    def reweight(self, likelihood: np.ndarray):
+        weights = self.weights * likelihood
+        total = weights.sum()
+        self.log_likelihood += np.log(total) if total > 0 else -np.inf
+        if total == 0:  # impossible evidence
+            self.weights = np.full(self.n_particles, np.nan)
+            return
+        self.weights = weights / total
+        if self.effective_sample_size() < self.resample_threshold * self.n_particles:
+            self.resample()
+
+    def resample(self):
+        """systematic resampling. The particles' query indicators are resampled with them"""
+        positions = (self.rng.random_sample() + np.arange(self.n_particles)) / self.n_particles
+        ancestors = np.minimum(np.searchsorted(np.cumsum(self.weights), positions), self.n_particles - 1)
+        self.flooded = self.flooded[ancestors]
+        self.indicators = self.indicators[:, ancestors]
+        self.weights = np.full(self.n_particles, 1 / self.n_particles)
+        self.n_resamples += 1
+
+    def probabilities(self) -> List[float]:
+        """the estimated probability of each query given all the evidence so far"""
+        return (self.indicators @ self.weights).tolist()
+
+    def run(self, evidence: List[Literal], horizon: int) -> List[float]:
+        """advance the filter up to (not including) slice horizon, applying the evidence slice by slice"""
+        evidence_by_slice: Dict[int, Dict[Tuple[bool, int], bool]] = {}
+        for t, is_edge, i, value in evidence:
+            evidence_by_slice.setdefault(t, {})[is_edge, i] = value
+        while self.t < horizon:
+            self.advance(evidence_by_slice.get(self.t, {}))
+        return self.probabilities()
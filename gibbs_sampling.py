@@ -0,0 +1,127 @@
+import numpy as np
+from typing import List, Tuple, Union
+from compiled_network import CompiledNetwork, UNASSIGNED_VALUE
+from sample_store import SampleStore
+
+INITIAL_CANDIDATES = 1000  # likelihood weighting samples from which the chains' initial states are drawn
+
+
+def get_children(network: CompiledNetwork) -> List[List[Tuple[int, int]]]:
+    """(child, bit of the node in the child's parents assignment) of each node"""
+    children = [[] for _ in range(network.n_nodes)]
+    for c in range(network.n_nodes):
+        n_parents = network.n_parents[c]
+        for k in range(n_parents):
+            children[network.parents[c, k]].append((c, 1 << (n_parents - 1 - k)))
+    return children
+
+
+def get_colors(network: CompiledNetwork) -> List[np.ndarray]:
+    """
+    Greedy coloring of the moral graph (parents, children and co-parents are neighbours).
+    The nodes of a color are conditionally independent given the other colors, so they can be resampled together
+    """
+    neighbours = [set() for _ in range(network.n_nodes)]
+    for c in range(network.n_nodes):
+        family = [c] + [int(p) for p in network.parents[c, :network.n_parents[c]]]
+        for u in family:
+            neighbours[u].update(w for w in family if w != u)
+    color = np.zeros(network.n_nodes, dtype=np.int64)
+    for v in range(network.n_nodes):
+        used = {color[u] for u in neighbours[v] if u < v}
+        color[v] = next(c for c in range(len(used) + 1) if c not in used)
+    return [np.flatnonzero(color == c) for c in range(color.max() + 1)] if network.n_nodes else []
+
+
+def potential_scale_reduction(means: np.ndarray, variances: np.ndarray, n: int) -> np.ndarray:
+    """
+    Gelman-Rubin R-hat of every query: sqrt(pooled variance estimate / within-chain variance).
+    Values close to 1 mean the chains mix into the same distribution
+    :param means: (n_chains x n_queries) per-chain means
+    :param variances: (n_chains x n_queries) per-chain sample variances
+    :param n: samples per chain
+    """
+    within = variances.mean(axis=0)
+    between = n * means.var(axis=0, ddof=1)
+    pooled = (n - 1) / n * within + between / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_hat = np.sqrt(pooled / within)
+    # chains stuck on the same constant value agree, chains stuck on different values don't
+    return np.where(within > 0, r_hat, np.where(between > 0, np.inf, 1.0))
+
+
+class GibbsSampler:
+    """
+    Gibbs sampling - Markov chains over the non-evidence nodes, each node is resampled from its distribution given
+    its Markov blanket: P(x | parents) * prod over children P(child | its parents, x).
+    All the nodes of a color are resampled at once, in all the chains.
+    """
+    def __init__(self, network: CompiledNetwork, evidence: np.ndarray):
+        """:param evidence: int array over the nodes - UNASSIGNED_VALUE, or the observed 0/1 value"""
+        self.network = network
+        self.evidence = evidence
+        is_free = evidence == UNASSIGNED_VALUE
+        children = get_children(network)
+        self.schedule = [self.get_color_update(nodes[is_free[nodes]], children)
+                         for nodes in get_colors(network)]
+
+    @staticmethod
+    def get_color_update(nodes: np.ndarray, children: List[List[Tuple[int, int]]]):
+        """the color's nodes, and the (position in nodes, child, bit) of every child link of these nodes"""
+        links = [(k, c, bit) for k, v in enumerate(nodes) for c, bit in children[v]]
+        positions, link_children, bits = (np.array(column, dtype=np.int64) for column in zip(*links)) if links else \
+            (np.zeros(0, dtype=np.int64),) * 3
+        return nodes, positions, link_children, bits
+
+    def get_initial_states(self, n_chains: int, rng: np.random.RandomState) -> Union[np.ndarray, None]:
+        """
+        (n_nodes x n_chains) initial states, drawn from likelihood weighting samples by their weights, so every chain
+        starts at a state consistent with the evidence
+        :return: None if no consistent state was found (impossible evidence)
+        """
+        X, weights = self.network.likelihood_weighting(self.evidence, max(INITIAL_CANDIDATES, n_chains), rng)
+        total_weight = weights.sum()
+        if total_weight == 0:
+            return None
+        return X[rng.choice(len(weights), n_chains, p=weights / total_weight)].T.copy()
+
+    def update(self, X: np.ndarray, color_update, rng: np.random.RandomState):
+        """resample the nodes of a color in every chain, from their Markov blanket conditionals (as log-odds)"""
+        nodes, positions, link_children, bits = color_update
+        if not len(nodes):
+            return
+        cpt = self.network.cpt
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            p_true = cpt[nodes[:, None], self.network.get_parents_assignment(X, nodes)]
+            log_odds = np.log(p_true) - np.log1p(-p_true)
+            if len(link_children):
+                assignment = self.network.get_parents_assignment(X, link_children)
+                p_if_false = cpt[link_children[:, None], assignment & ~bits[:, None]]
+                p_if_true = cpt[link_children[:, None], assignment | bits[:, None]]
+                child_values = X[link_children]
+                likelihood_if_false = np.where(child_values, p_if_false, 1 - p_if_false)
+                likelihood_if_true = np.where(child_values, p_if_true, 1 - p_if_true)
+                np.add.at(log_odds, positions, np.log(likelihood_if_true) - np.log(likelihood_if_false))
+            X[nodes] = rng.random_sample(log_odds.shape) < 1 / (1 + np.exp(-log_odds))
+
+    def run(self, n_samples: int, n_chains: int, burn_in: int, thin: int,
+            rng: np.random.RandomState) -> List[SampleStore]:
+        """
+        :param n_samples: total number of samples to keep, split evenly between the chains
+        :param burn_in: number of sweeps discarded at the beginning of each chain
+        :param thin: keep every thin-th sweep
+        :return: the samples of each chain, with unit weights (empty if the evidence is impossible)
+        """
+        n_per_chain = -(-n_samples // n_chains)
+        X = self.get_initial_states(n_chains, rng)
+        if X is None:
+            empty = SampleStore.from_matrix(np.zeros((0, self.network.n_nodes), dtype=bool), np.zeros(0))
+            return [empty] * n_chains
+        draws = []
+        for sweep in range(burn_in + n_per_chain * thin):
+            for color_update in self.schedule:
+                self.update(X, color_update, rng)
+            if sweep >= burn_in and (sweep - burn_in) % thin == thin - 1:
+                draws.append(np.packbits(X.T, axis=1))
+        bits = np.stack(draws, axis=1)  # chains x samples x packed nodes
+        return [SampleStore(chain_bits, np.ones(n_per_chain), self.network.n_nodes) for chain_bits in bits]
@@ -1,10 +1,32 @@
 import re
+import sys
+import json
+import time
+import itertools
+from contextlib import nullcontext
 from configurator import Configurator
 from utils.data_structures import Edge, Node, Graph
-from bayes_network import FloodBNNode, EdgeBNNode, BayesNetwork
+from bayes_network import BNNode, FloodBNNode, EdgeBNNode, BayesNetwork
+from compiled_network import CompiledNetwork
+from utils import instrumentation
+from path_search import SamplesPathScorer, RaoBlackwellPathScorer, QueryPathScorer, best_free_paths
+from typing import Iterable, Iterator, List, Tuple, Dict
 
 fraction_re = re.compile("(1(?:\.0)?|0\.[0-9]+)")
 TEST_MODE = True
+BATCH_CHUNK_SIZE = 1000  # batch mode scenarios evaluated (grouped by evidence) and written together
+
+if TEST_MODE:
+    block_pattern = re.compile("(~)?B\(E(\d+),\s*(\d+)\)")
+    flood_pattern = re.compile("(~)?F\(V(\d+),\s*(\d+)\)")
+    evidence_prompt = 'type in evidence e.g. "~B(E1,0)","F(V1,1)". ^C or type "end" to return to menu\n'
+else:
+    block_pattern = re.compile("(No\s+)?blockage reported at edge (\d+) at time (\d+)", re.IGNORECASE)
+    flood_pattern = re.compile("(No\s+)?Flood reported at vertex (\d+) at time (\d+)", re.IGNORECASE)
+    evidence_prompt = """type in reading one piece of evidence at a time 
+    (e.g. "Flood reported at vertex 2 at time 0", and then "No blockage reported at edge 1 at time 0" etc.)
+    type ^C or "end" to return to menu
+    """.replace('  ', '')
 
 
 def get_list_input(prompt):
@@ -14,123 +36,155 @@ def get_list_input(prompt):
 class Simulator:
     """Hurricane evacuation simulator"""
 
-    def __init__(self):
-        G, BN = self.get_graph()
+    def __init__(self, graph_path=None, T=None):
+        G, BN = self.get_graph(graph_path, T)
         self.G: Graph = G
         self.BN: BayesNetwork = BN
 
+    @property
+    def metrics(self) -> Dict:
+        """the instrumentation of the run so far: time per phase, counters and gauges"""
+        report = instrumentation.metrics.as_dict()
+        if self.BN.posterior_cache is not None:
+            report['counters'].update(posterior_cache_hits=self.BN.posterior_cache.hits,
+                                      posterior_cache_misses=self.BN.posterior_cache.misses)
+        return report
+
     @staticmethod
-    def get_graph():
-        return Simulator.parse_graph(Configurator.graph_path)
+    def get_graph(graph_path=None, T=None):
+        return Simulator.parse_graph(Configurator.graph_path if graph_path is None else graph_path,
+                                     Configurator.T if T is None else T)
 
     @staticmethod
-    def parse_graph(path):
-        """Parse and create graph from tests file, syntax same as in assignment instructions"""
-        num_v_pattern = re.compile("#N\s+(\d+)")
-        edge_pattern = re.compile("#(E\d+)\s+(\d+)\s+(\d+)\s+W(\d+)")
-        node_pattern = re.compile("#V(\d+)\s+F\s+" + fraction_re.pattern)
-        persistence_pattern = re.compile("#Ppersistence\s+" + fraction_re.pattern)
+    @instrumentation.metrics.timed('load_graph')
+    def parse_graph(path, T):
+        """
+        Parse and create graph from tests file, syntax same as in assignment instructions.
+        If Configurator.snapshot_dir is set, the compiled network is loaded from a snapshot of the same file and T
+        (or saved for the next runs)
+        """
+        # each line is matched only against the pattern of its type (by the character following the '#')
+        patterns = {
+            'N': re.compile("#N\s+(\d+)"),
+            'E': re.compile("#(E\d+)\s+(\d+)\s+(\d+)\s+W(\d+)"),
+            'V': re.compile("#V(\d+)\s+F\s+" + fraction_re.pattern),
+            'P': re.compile("#Ppersistence\s+" + fraction_re.pattern)
+        }
 
         p_persistence = 0
-        bn_node_dict = {}
-        node_dict = {}
-        bn_nodes = []  # list of nodes for the Bayer Network. Each node represents either an edge/vertex at some time t
-        E = []
-
-        with open(path, 'r') as f:
-            for line in f.readlines():
-                if not line.startswith('#'):
+        n_vertices = 0
+        chances = {}  # vertex index -> flooding probability at time 0
+        edges = []  # (name, v1 index, v2 index, weight)
+
+        with open(path, 'r') as f, instrumentation.metrics.timer('parse'):
+            for line in f:
+                pattern = patterns.get(line[1:2]) if line.startswith('#') else None
+                match = pattern.match(line) if pattern else None
+                if not match:
                     continue
-                # parse Ppersistence
-                match = persistence_pattern.match(line)
-                if match:
+                line_type = line[1]
+                if line_type == 'P':  # parse Ppersistence
                     p_persistence = float(match.group(1))
-                    FloodBNNode.P_PERSISTENCE = p_persistence
-                # parse number of nodes
-                match = num_v_pattern.match(line)
-                if match:
+                elif line_type == 'N':  # parse number of nodes
                     n_vertices = int(match.group(1))
-                    for i in range(1, n_vertices+1):
-                        t = 0
-                        index = str(i)
-                        new_node = Node('V'+index)
-                        node_dict[index] = new_node
-                        new_bn_node = FloodBNNode(v=new_node, time=t, chance=0, p_persistence=p_persistence)
-                        bn_nodes.append(new_bn_node)
-                        bn_node_dict[index, t] = new_bn_node
-                # parse nodes
-                match = node_pattern.match(line)
-                if match:
+                elif line_type == 'V':  # parse nodes
                     index, chance = match.groups()
-                    bn_node_dict[index, 0].chance = float(chance)
-                # parse edges
-                match = edge_pattern.match(line)
-                if match:
-                    name, v1_index, v2_index, weight = match.groups()
-                    v1 = node_dict[v1_index]
-                    v2 = node_dict[v2_index]
-                    new_edge = Edge(v1, v2, int(weight), name)
-                    E.append(new_edge)
-                    bn_nodes.append(EdgeBNNode(e=new_edge, time=0))
+                    chances[index] = float(chance)
+                else:  # parse edges
+                    edges.append(match.groups())
 
+        node_dict = {str(i): Node('V' + str(i)) for i in range(1, n_vertices + 1)}
         V = list(node_dict.values())
+        E = [Edge(node_dict[v1_index], node_dict[v2_index], int(weight), name)
+             for name, v1_index, v2_index, weight in edges]
 
-        # generate the rest of the Bayes Network nodes after parsing the initial state is done
+        # generate the Bayes Network nodes after parsing is done, so all nodes are created with the final parameters.
+        # Each node represents either an edge/vertex at some time t
         # order matters: vertices in each time unit must be created before edges
-        for t in range(1, Configurator.T):
-            for v in V:
-                bn_nodes.append(FloodBNNode(v, t))
+        bn_nodes = []
+        flood_bn_nodes = {}  # (vertex, t) -> FloodBNNode
+        for t in range(max(T, 1)):
+            for index, v in node_dict.items():
+                flood_bn_nodes[v, t] = FloodBNNode(v, t,
+                                                   chance=chances.get(index, 0) if t == 0 else 0,
+                                                   p_persistence=p_persistence,
+                                                   parent=flood_bn_nodes.get((v, t - 1)))
+                bn_nodes.append(flood_bn_nodes[v, t])
             for e in E:
-                bn_nodes.append(EdgeBNNode(e, t))
+                bn_nodes.append(EdgeBNNode(e, t, parents=[flood_bn_nodes[e.v1, t], flood_bn_nodes[e.v2, t]]))
 
-        return Graph(V, E), BayesNetwork(bn_nodes)
+        compiled, snapshot_path = None, None
+        if Configurator.snapshot_dir:
+            snapshot_path = CompiledNetwork.get_snapshot_path(Configurator.snapshot_dir, path, T)
+            with instrumentation.metrics.timer('snapshot_load'):
+                compiled = CompiledNetwork.load(snapshot_path)
+        with instrumentation.metrics.timer('network_construction'):
+            BN = BayesNetwork(bn_nodes, compiled)
+        if snapshot_path is not None and compiled is None:
+            with instrumentation.metrics.timer('snapshot_save'):
+                BN.compiled.save(snapshot_path)
+        instrumentation.metrics.gauge('network_nodes', len(bn_nodes))
+        return Graph(V, E), BN
 
-    def add_evidence(self):
-        if TEST_MODE:
-            block_pattern = re.compile("(~)?B\(E(\d+),\s*(\d+)\)")
-            flood_pattern = re.compile("(~)?F\(V(\d+),\s*(\d+)\)")
-            evidence_prompt = 'type in evidence e.g. "~B(E1,0)","F(V1,1)". ^C or type "end" to return to menu\n'
+    def parse_evidence(self, raw_evidence: str) -> Tuple[BNNode, bool]:
+        """:return: the Bayes Network node and its observed value. raises ValueError for invalid evidence"""
+        block_evidence = block_pattern.match(raw_evidence)
+        if block_evidence:
+            blocked_prefix, edge_idx, time = block_evidence.groups()
+            is_blocked_or_flooded = blocked_prefix is None
+            edge_label = 'E' + edge_idx
+            time = int(time)
+            bn_node = self.BN.get_node(edge_label, time)
         else:
-            block_pattern = re.compile("(No\s+)?blockage reported at edge (\d+) at time (\d+)", re.IGNORECASE)
-            flood_pattern = re.compile("(No\s+)?Flood reported at vertex (\d+) at time (\d+)", re.IGNORECASE)
-            evidence_prompt = """type in reading one piece of evidence at a time 
-            (e.g. "Flood reported at vertex 2 at time 0", and then "No blockage reported at edge 1 at time 0" etc.)
-            type ^C or "end" to return to menu
-            """.replace('  ', '')
+            flood_evidence = flood_pattern.match(raw_evidence)
+            if flood_evidence:
+                flooded_prefix, node_idx, time = flood_evidence.groups()
+                is_blocked_or_flooded = flooded_prefix is None
+                node_label = 'V' + node_idx
+                time = int(time)
+                bn_node = self.BN.get_node(node_label, time)
+            else:
+                raise ValueError("invalid evidence string")
+
+        if bn_node is None:
+            raise ValueError("invalid (edge/vertex, time) pair")
+        return bn_node, is_blocked_or_flooded
+
+    def add_evidence(self):
         try:
             while True:
                 raw_evidence = input(evidence_prompt)
                 if raw_evidence == 'end':
                     break
-                block_evidence = block_pattern.match(raw_evidence)
-                if block_evidence:
-                    blocked_prefix, edge_idx, time = block_evidence.groups()
-                    is_blocked_or_flooded = blocked_prefix is None
-                    edge_label = 'E' + edge_idx
-                    time = int(time)
-                    bn_node = self.BN.get_node(edge_label, time)
-                else:
-                    flood_evidence = flood_pattern.match(raw_evidence)
-                    if flood_evidence:
-                        flooded_prefix, node_idx, time = flood_evidence.groups()
-                        is_blocked_or_flooded = flooded_prefix is None
-                        node_label = 'V' + node_idx
-                        time = int(time)
-                        bn_node = self.BN.get_node(node_label, time)
-                    else:
-                        print("invalid evidence string")
-                        continue
-
-                if bn_node is None:
-                    print("invalid (edge/vertex, time) pair")
+                try:
+                    bn_node, is_blocked_or_flooded = self.parse_evidence(raw_evidence)
+                except ValueError as e:
+                    print(e)
                     continue
 
-                bn_node.value = is_blocked_or_flooded
+                self.BN.add_evidence(bn_node, is_blocked_or_flooded)
                 print('fixed {} = {}'.format(bn_node, bn_node.value))
 
         except KeyboardInterrupt:  # ^C pressed
             return
 
+    def stream_evidence(self, events: Iterable[str]) -> Iterator[Tuple[BNNode, bool]]:
+        """
+        Non-interactive evidence ingestion, for reports arriving continuously (e.g. "F(V1,0)", "~B(E1,0)").
+        The samples of the current evidence are reweighted by each new report instead of being regenerated,
+        unless their effective sample size falls below Configurator.ess_threshold * N.
+        Lazy - each report is applied when the generator reaches it, so queries can be made between reports.
+        :return: a generator of the applied (bn_node, value) pairs. Invalid reports are skipped
+        """
+        for raw_evidence in events:
+            try:
+                bn_node, is_blocked_or_flooded = self.parse_evidence(raw_evidence.strip())
+            except ValueError as e:
+                print('{}: {}'.format(e, raw_evidence.strip()))
+                continue
+            self.BN.add_evidence(bn_node, is_blocked_or_flooded, incremental=True)
+            yield bn_node, is_blocked_or_flooded
+
     def query_vertex_flood_probability(self):
         flood_queries = [{v: True} for v in self.BN.V if isinstance(v, FloodBNNode)]
         self.BN.sample_queries(flood_queries)
@@ -139,9 +193,12 @@ class Simulator:
         block_queries = [{e: True} for e in self.BN.V if isinstance(e, EdgeBNNode)]
         self.BN.sample_queries(block_queries)
 
-    def query_free_path_probability_helper(self, edges, t, verbose=True):
+    def get_free_path_query(self, edges, t):
         edge_bn_nodes = [self.BN.get_node(e, t) for e in edges]
-        block_query = [{e: False for e in edge_bn_nodes}]
+        return {e: False for e in edge_bn_nodes}
+
+    def query_free_path_probability_helper(self, edges, t, verbose=True):
+        block_query = [self.get_free_path_query(edges, t)]
         return self.BN.sample_queries(block_query, verbose=verbose)
 
     def query_free_path_probability(self):
@@ -153,27 +210,166 @@ class Simulator:
         except:
             print("invalid time or edge indeces")
 
+    def get_path_scorer(self, t):
+        """sampling engines score all the paths on the shared samples, other engines score each path by a query"""
+        shared_samples = self.BN.has_shared_samples()
+        if shared_samples and Configurator.rao_blackwell:
+            samples = self.BN.get_weighted_samples()
+            return RaoBlackwellPathScorer(
+                samples, lambda edge: self.BN.get_free_probabilities(samples, self.BN.get_node(edge, t)))
+        if shared_samples:
+            edge_columns = {e.label: self.BN.index[self.BN.get_node(e.label, t)] for e in self.G.get_edges()}
+            return SamplesPathScorer(self.BN.get_weighted_samples(), edge_columns)
+        return QueryPathScorer(lambda edges: self.query_free_path_probability_helper(edges, t, verbose=False)[0][2])
+
+    @instrumentation.metrics.timed('path_search')
+    def get_best_free_paths(self, src, tgt, t, k=1, max_hops=None) -> List[Tuple[List[str], float]]:
+        """:return: the k paths from src to tgt (vertex labels) most likely to be free at time t, with probabilities"""
+        vertices = {v.label: v for v in self.G.get_vertices()}
+        return best_free_paths(self.G, vertices[src], vertices[tgt], self.get_path_scorer(t), k, max_hops)
+
     def query_best_probable_path(self):
         try:
             t = int(input('choose time for query:\n'))
             nodes_raw = get_list_input('type in comma separated vertex indeces, e.g. "1,3" for V1,V3')
             src, tgt = ['V' + i for i in nodes_raw]
             path_str = '\n{0}->{{}}->{1}:'.format(src, tgt)
-            simple_paths = self.G.get_simple_paths(src, tgt)
-            paths_blockage_queries_results = []
-            for path_edges_list in simple_paths:
-                path_query, evidence, probability = self.query_free_path_probability_helper(path_edges_list, t, verbose=False)[0]
-                paths_blockage_queries_results.append((path_query, evidence, probability))
-            path_result_pairs = list(zip(simple_paths, paths_blockage_queries_results))
-            for path_edges, query in path_result_pairs:
+            max_hops = Configurator.max_hops if Configurator.max_hops > 0 else None
+            best_paths = self.get_best_free_paths(src, tgt, t, Configurator.top_paths, max_hops)
+            if not best_paths:
+                print('no path from {} to {}'.format(src, tgt))
+                return
+            evidence = self.BN.get_evidence()
+            for path_edges, prob in best_paths:
                 print(path_str.format('->'.join(path_edges)))
-                self.BN.print_query_result(query)
-            best_path, unblocked_prob = max(path_result_pairs, key=lambda pq: pq[1][2])
+                print(self.BN.query_results_tostring(self.get_free_path_query(path_edges, t), evidence, prob))
+            best_path, unblocked_prob = best_paths[0]
             print('\nThe best option is: {}\nP(Path is unblocked)={}\n'
-                  .format(path_str.format('->'.join(best_path)), unblocked_prob[2]))
+                  .format(path_str.format('->'.join(best_path)), unblocked_prob))
         except:
             print("invalid time or vertices")
 
+    def parse_query(self, query: Dict) -> Dict[BNNode, bool]:
+        """
+        a flood/blockage/path query of a batch scenario, as an assignment. raises ValueError for invalid queries
+        e.g. {"type": "flood", "vertex": "V1", "t": 0}, {"type": "blockage", "edge": "E2", "t": 1},
+             {"type": "path", "edges": ["E1", "E2"], "t": 1} (the probability that the path is free)
+        """
+        query_type, t = query.get('type'), int(query.get('t', 0))
+        if query_type == 'flood':
+            labels, value = [query['vertex']], True
+        elif query_type == 'blockage':
+            labels, value = [query['edge']], True
+        elif query_type == 'path':
+            labels, value = query['edges'], False
+        else:
+            raise ValueError('invalid query type: {}'.format(query_type))
+        bn_nodes = [self.BN.get_node(label, t) for label in labels]
+        if None in bn_nodes:
+            raise ValueError("invalid (edge/vertex, time) pair")
+        return {bn_node: value for bn_node in bn_nodes}
+
+    def run_batch(self, scenarios: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Non-interactive queries - evaluate scenarios of evidence and queries, e.g.
+        {"id": 1, "evidence": ["B(E1,1)", "~F(V2,0)"],
+         "queries": [{"type": "flood", "vertex": "V1", "t": 0},
+                     {"type": "best_path", "src": "V1", "tgt": "V4", "t": 1}]}
+        (best_path also takes optional "k" and "max_hops" - 0 or missing is unlimited).
+        Scenarios with the same evidence are evaluated together: on one set of samples, and all their
+        flood/blockage/path queries in a single batched evaluation.
+        :return: a generator of a result per scenario, in the scenarios order (after all of them are evaluated)
+        """
+        results: Dict[int, Dict] = {}  # by the scenario's position
+        groups: Dict[frozenset, List[Tuple[int, Dict]]] = {}
+        n_scenarios = 0
+        for position, scenario in enumerate(scenarios):
+            n_scenarios += 1
+            if 'error' in scenario:  # unreadable scenario
+                results[position] = scenario
+                continue
+            try:
+                evidence = frozenset(self.parse_evidence(e) for e in scenario.get('evidence', []))
+                if len({bn_node for bn_node, _ in evidence}) < len(evidence):
+                    raise ValueError('contradicting evidence')
+            except ValueError as e:
+                results[position] = {'id': scenario.get('id'), 'error': str(e)}
+                continue
+            groups.setdefault(evidence, []).append((position, scenario))
+
+        for evidence, group in groups.items():
+            self.BN.reset_evidence()
+            for bn_node, value in evidence:
+                self.BN.add_evidence(bn_node, value)
+            parsed = []  # the queries of each scenario, with the positions of its assignments in the batch
+            assignments = []
+            for _, scenario in group:
+                try:
+                    queries = []
+                    for query in scenario.get('queries', []):
+                        if query.get('type') == 'best_path':
+                            queries.append((query, None))
+                        else:
+                            queries.append((query, len(assignments)))
+                            assignments.append(self.parse_query(query))
+                    parsed.append(queries)
+                except (ValueError, KeyError, TypeError) as e:
+                    parsed.append(str(e))
+            start_time = time.time()
+            probabilities = [prob for _, _, prob in self.BN.sample_queries(assignments, verbose=False)]
+            group_seconds = time.time() - start_time
+            for (position, scenario), queries in zip(group, parsed):
+                if isinstance(queries, str):
+                    results[position] = {'id': scenario.get('id'), 'error': queries}
+                    continue
+                start_time = time.time()
+                query_results = []
+                for query, assignment_position in queries:
+                    if assignment_position is not None:
+                        query_results.append(dict(query, probability=probabilities[assignment_position]))
+                        continue
+                    try:
+                        max_hops = int(query.get('max_hops', 0)) or None  # 0 - unlimited, like --max_hops
+                        paths = self.get_best_free_paths(query['src'], query['tgt'], int(query.get('t', 0)),
+                                                         int(query.get('k', 1)), max_hops)
+                        query_results.append(dict(query, paths=[{'edges': edges, 'probability': prob}
+                                                                for edges, prob in paths]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        query_results.append(dict(query, error=str(e)))
+                results[position] = {'id': scenario.get('id'),
+                                     'evidence': scenario.get('evidence', []),
+                                     'results': query_results,
+                                     'engine': Configurator.engine,
+                                     'samples': self.BN.get_sample_count(),
+                                     'seconds': group_seconds + time.time() - start_time}
+        self.BN.reset_evidence()
+        for position in range(n_scenarios):
+            yield results.pop(position)
+
+    def run_batch_file(self, input_path: str, output_path=''):
+        """
+        run_batch over a JSON lines file of scenarios, streaming JSON lines results (to stdout by default) in the
+        input order. The input is evaluated in chunks of BATCH_CHUNK_SIZE scenarios, so the results of a chunk are
+        written before the next one is read
+        """
+        def read_scenarios(f):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield {'id': 'line {}'.format(line_number), 'error': 'invalid JSON: {}'.format(e)}
+
+        with open(input_path) as f_in, (open(output_path, 'w') if output_path else nullcontext(sys.stdout)) as f_out:
+            scenarios = read_scenarios(f_in)
+            while True:
+                chunk = list(itertools.islice(scenarios, BATCH_CHUNK_SIZE))
+                if not chunk:
+                    break
+                for result in self.run_batch(chunk):
+                    f_out.write(json.dumps(result) + '\n')
+                f_out.flush()
 
     def print_graph(self):
         self.BN.print_net()
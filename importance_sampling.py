@@ -0,0 +1,80 @@
+import numpy as np
+from typing import List
+from compiled_network import CompiledNetwork, UNASSIGNED_VALUE
+from sample_store import SampleStore
+
+PROPOSAL_CUTOFF = 0.04  # proposal probabilities are kept in [cutoff, 1-cutoff], to keep the weights' tails light
+INITIAL_LEARNING_RATE = 0.4
+FINAL_LEARNING_RATE = 0.14
+
+
+class AdaptiveImportanceSampler:
+    """
+    Adaptive importance sampling (AIS-BN).
+    The free nodes with children (the flooding chains) are sampled from proposal CPTs instead of their own CPTs,
+    and the proposals are learned from the weighted samples of earlier batches, moving towards the posterior
+    P(node | parents, evidence). Leaves keep their own CPTs - given their parents, that is their posterior.
+    A proposal over the network's own structure can't express every posterior (e.g. two floods explaining the same
+    observed blockage), so the samples are finally drawn from the proposal that had the best effective sample size.
+    """
+    def __init__(self, network: CompiledNetwork, evidence: np.ndarray, proposal: np.ndarray = None):
+        """
+        :param evidence: int array over the nodes - UNASSIGNED_VALUE, or the observed 0/1 value
+        :param proposal: initial proposal CPTs (indexed like the network's cpt), the network's CPTs by default
+        """
+        self.network = network
+        self.evidence = evidence
+        self.learned = (evidence == UNASSIGNED_VALUE) & ~network.is_leaf  # nodes with a learned proposal
+        self.proposal = (network.cpt if proposal is None else proposal).copy()
+        self.proposal[self.learned] = self.cutoff(self.proposal[self.learned], network.cpt[self.learned])
+        self.effective_sample_sizes: List[float] = []  # ESS of each learning batch, as a fraction of its size
+        self.best_proposal = self.proposal
+        # weight of the learning samples on every (learned node, parents assignment), and on the node being True
+        self.assignment_weights = np.zeros((int(self.learned.sum()), network.cpt.shape[1]))
+        self.true_weights = np.zeros(self.assignment_weights.shape)
+
+    @staticmethod
+    def cutoff(proposal: np.ndarray, cpt: np.ndarray) -> np.ndarray:
+        """keep the proposal away from 0 and 1, except where the CPT itself is deterministic"""
+        deterministic = (cpt == 0) | (cpt == 1)
+        return np.where(deterministic, cpt, np.clip(proposal, PROPOSAL_CUTOFF, 1 - PROPOSAL_CUTOFF))
+
+    def estimate_posterior(self, samples: SampleStore) -> np.ndarray:
+        """
+        estimate P(node | parents, evidence) for the learned nodes from all the weighted samples so far
+        (every batch's weights are unbiased for the same joint distribution, so the batches are pooled).
+        The current proposal is kept where the samples have no weight on a parents assignment
+        """
+        nodes = np.flatnonzero(self.learned)
+        n_configs = self.network.cpt.shape[1]
+        X = samples.to_matrix().T
+        assignment = self.network.get_parents_assignment(X, nodes)
+        cells = (np.arange(len(nodes))[:, None] * n_configs + assignment).ravel()
+        weights = np.broadcast_to(samples.weights, assignment.shape).ravel()
+        self.assignment_weights += np.bincount(cells, weights, minlength=len(nodes) * n_configs).reshape(
+            len(nodes), n_configs)
+        self.true_weights += np.bincount(cells, weights * X[nodes].ravel(), minlength=len(nodes) * n_configs).reshape(
+            len(nodes), n_configs)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.assignment_weights > 0, self.true_weights / self.assignment_weights,
+                            self.proposal[nodes])
+
+    def learn(self, n_batches: int, batch_size: int, rng: np.random.RandomState):
+        """
+        update the proposal from n_batches batches of samples:
+        proposal += learning rate * (estimated posterior - proposal), with a decreasing learning rate
+        """
+        for k in range(n_batches):
+            batch = self.network.generate_samples(self.evidence, batch_size, rng, self.proposal)
+            self.effective_sample_sizes.append(batch.effective_sample_size() / max(1, len(batch)))
+            if self.effective_sample_sizes[-1] >= max(self.effective_sample_sizes):
+                self.best_proposal = self.proposal.copy()
+            if batch.total_weight() == 0:
+                continue
+            rate = INITIAL_LEARNING_RATE * (FINAL_LEARNING_RATE / INITIAL_LEARNING_RATE) ** (k / max(1, n_batches - 1))
+            learned = self.proposal[self.learned]
+            learned += rate * (self.estimate_posterior(batch) - learned)
+            self.proposal[self.learned] = self.cutoff(learned, self.network.cpt[self.learned])
+
+    def generate_samples(self, n_samples: int, rng: np.random.RandomState) -> SampleStore:
+        return self.network.generate_samples(self.evidence, n_samples, rng, self.best_proposal)
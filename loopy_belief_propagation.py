@@ -0,0 +1,207 @@
+import numpy as np
+from typing import List
+from dbn_filtering import SliceTemplate, Literal
+
+
+def normalize(messages: np.ndarray) -> np.ndarray:
+    """normalize binary messages (last axis) to sum to 1"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return messages / messages.sum(axis=-1, keepdims=True)
+
+
+class LoopyBeliefPropagation:
+    """
+    Loopy belief propagation over the unrolled DBN, vectorized over all the time slices, vertices and edges.
+    Every vertex's flooding over time is a chain, passing forward (alpha) and backward (beta) messages.
+    Unobserved blockages are barren - they don't send messages to the flooding nodes, so only the observed
+    blockages couple the chains. Their noisy-OR messages take O(k) per parent instead of a sum over the CPT, using
+    P(B=False | flooding) = prod over flooded parents q_i - leakage * [no parent is flooded].
+    The messages are updated in parallel (damped) until no message changes by more than the tolerance.
+    Impossible evidence (zero probability) is detected before propagating, and gives NaN, like the other engines
+    """
+    def __init__(self, template: SliceTemplate, horizon: int, damping=0.3, tolerance=1e-6, max_iterations=200):
+        """
+        :param horizon: number of time slices
+        :param damping: fraction of the previous message kept in every update
+        """
+        self.template = template
+        self.horizon = horizon
+        self.damping = damping
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        n_vertices, n_edges = len(template.vertex_labels), len(template.edge_labels)
+        cpt = template.flood_cpt
+        self.prior = np.stack([1 - cpt[:, 0], cpt[:, 0]], axis=-1)  # |V| x 2
+        self.transition = np.stack([np.stack([1 - cpt[:, 1], cpt[:, 1]], axis=-1),
+                                    np.stack([1 - cpt[:, 2], cpt[:, 2]], axis=-1)], axis=1)  # |V| x prev x next
+        # noisy-OR parameters: P(B | only v1 flooded) = 1 - q1, P(B | only v2 flooded) = 1 - q2
+        self.leakage = template.edge_cpt[:, 0]
+        self.inhibitors = np.stack([1 - template.edge_cpt[:, 2], 1 - template.edge_cpt[:, 1]], axis=-1)  # |E| x 2
+        self.alpha = np.full((horizon, n_vertices, 2), 0.5)  # message from Fl(v,t-1) (the prior at t=0)
+        self.alpha[0] = self.prior
+        self.beta = np.full((horizon, n_vertices, 2), 0.5)  # message from Fl(v,t+1)
+        self.edge_messages = np.full((horizon, n_edges, 2, 2), 0.5)  # from B(e,t) to each of its two vertices
+        self.flood_evidence = np.ones((horizon, n_vertices, 2))
+        self.edge_evidence = np.full((horizon, n_edges), -1, dtype=np.int64)  # -1 unobserved, else 0/1
+        self.iterations = 0
+        self.converged = False
+        self.possible = True  # whether the last run's evidence has a positive probability
+
+    def set_evidence(self, evidence: List[Literal]):
+        self.flood_evidence[:] = 1
+        self.edge_evidence[:] = -1
+        for t, is_edge, i, value in evidence:
+            if is_edge:
+                self.edge_evidence[t, i] = int(value)
+            else:
+                self.flood_evidence[t, i, int(not value)] = 0
+
+    def is_possible(self) -> bool:
+        """
+        whether the evidence has a positive probability - a forward pass over every vertex's chain of the flooding
+        states with a positive probability given the evidence so far, and the observed blockages must have a positive
+        probability given those. (The messages of impossible evidence have zero normalizers, and never converge)
+        """
+        support = np.empty(self.alpha.shape, dtype=bool)
+        support[0] = (self.prior > 0) & (self.flood_evidence[0] > 0)
+        for t in range(1, self.horizon):
+            support[t] = (support[t - 1, :, :, None] & (self.transition > 0)).any(axis=1) & \
+                (self.flood_evidence[t] > 0)
+        if not support.any(axis=-1).all():
+            return False
+        observed_t, observed_e = np.nonzero(self.edge_evidence >= 0)
+        vertices = self.template.edge_vertices[observed_e]
+        p_blocked = self.template.edge_cpt[observed_e]  # by 2 * Fl(v1) + Fl(v2)
+        p_value = np.where(self.edge_evidence[observed_t, observed_e, None] == 1, p_blocked, 1 - p_blocked)
+        s1, s2 = support[observed_t, vertices[:, 0]], support[observed_t, vertices[:, 1]]
+        assignments = np.stack([s1[:, 0] & s2[:, 0], s1[:, 0] & s2[:, 1], s1[:, 1] & s2[:, 0], s1[:, 1] & s2[:, 1]],
+                               axis=-1)
+        return bool((assignments & (p_value > 0)).any(axis=-1).all())
+
+    def get_edge_products(self, observed_t, observed_e) -> np.ndarray:
+        """(horizon x |V| x 2) product of the observed blockages' messages to every flooding node"""
+        products = np.ones(self.alpha.shape)
+        vertices = self.template.edge_vertices[observed_e]
+        for side in range(2):
+            np.multiply.at(products, (observed_t, vertices[:, side]), self.edge_messages[observed_t, observed_e, side])
+        return products
+
+    def get_noisy_or_messages(self, observed_t, observed_e, incoming: np.ndarray) -> np.ndarray:
+        """
+        messages from observed blockages to their vertices, given the vertices' messages to the blockages
+        :param incoming: (n_observed x 2 sides x 2) normalized messages from the edges' vertices
+        """
+        q = self.inhibitors[observed_e]
+        leakage = self.leakage[observed_e][:, None]
+        other = incoming[:, ::-1]  # the message from the other vertex, for each side
+        # sum over the other vertex of P(B=False | this, other) * message(other), for this = False / True
+        free_if_other_free = other[..., 0] + q[:, ::-1] * other[..., 1]
+        free = np.stack([free_if_other_free - leakage * other[..., 0], q * free_if_other_free], axis=-1)
+        blocked = self.edge_evidence[observed_t, observed_e].astype(bool)[:, None, None]
+        return normalize(np.where(blocked, other.sum(axis=-1, keepdims=True) - free, free))
+
+    def forward(self, messages: np.ndarray) -> np.ndarray:
+        """sum over x of messages(Fl(v,t) = x) * P(Fl(v,t+1) | x), for every slice and vertex"""
+        return messages[..., :1] * self.transition[:, 0] + messages[..., 1:] * self.transition[:, 1]
+
+    def backward(self, messages: np.ndarray) -> np.ndarray:
+        """sum over y of P(y | Fl(v,t-1)) * messages(Fl(v,t) = y), for every slice and vertex"""
+        return self.transition[..., 0] * messages[..., :1] + self.transition[..., 1] * messages[..., 1:]
+
+    def damp(self, old: np.ndarray, new: np.ndarray) -> np.ndarray:
+        return self.damping * old + (1 - self.damping) * new
+
+    def run(self, evidence: List[Literal]):
+        """propagate until convergence. The messages of the previous run are the starting point"""
+        self.set_evidence(evidence)
+        observed_t, observed_e = np.nonzero(self.edge_evidence >= 0)
+        vertices = self.template.edge_vertices[observed_e]
+        self.converged = False
+        self.iterations = 0
+        self.possible = self.is_possible()
+        if not self.possible:
+            return
+        for self.iterations in range(1, self.max_iterations + 1):
+            edge_products = self.get_edge_products(observed_t, observed_e)
+            local = self.flood_evidence * edge_products
+            alpha, beta = self.alpha.copy(), self.beta.copy()
+            alpha[1:] = normalize(self.forward(self.alpha[:-1] * local[:-1]))
+            beta[:-1] = normalize(self.backward(local[1:] * self.beta[1:]))
+            # the vertices' messages to the observed blockages - everything but the blockage's own message
+            # (noisy-OR messages are positive while the leakage is)
+            beliefs = self.alpha * self.beta * local
+            incoming = normalize(np.stack([beliefs[observed_t, vertices[:, side]] for side in range(2)], axis=1) /
+                                 self.edge_messages[observed_t, observed_e])
+            edge_messages = self.get_noisy_or_messages(observed_t, observed_e, incoming)
+            change = max(np.abs(alpha - self.alpha).max(initial=0), np.abs(beta - self.beta).max(initial=0),
+                         np.abs(edge_messages - self.edge_messages[observed_t, observed_e]).max(initial=0))
+            self.alpha = self.damp(self.alpha, alpha)
+            self.beta = self.damp(self.beta, beta)
+            self.edge_messages[observed_t, observed_e] = self.damp(self.edge_messages[observed_t, observed_e],
+                                                                   edge_messages)
+            if change < self.tolerance:
+                self.converged = True
+                break
+
+    def get_flood_beliefs(self) -> np.ndarray:
+        """(horizon x |V| x 2) approximate posterior of every flooding node"""
+        edge_products = self.get_edge_products(*np.nonzero(self.edge_evidence >= 0))
+        return normalize(self.alpha * self.beta * self.flood_evidence * edge_products)
+
+    def get_edge_marginals(self, flood_beliefs: np.ndarray) -> np.ndarray:
+        """(horizon x |E|) approximate posterior probability of every blockage"""
+        v1, v2 = self.template.edge_vertices[:, 0], self.template.edge_vertices[:, 1]
+        b1, b2 = flood_beliefs[:, v1], flood_beliefs[:, v2]
+        q = self.inhibitors
+        free = (b1[..., 0] + q[:, 0] * b1[..., 1]) * (b2[..., 0] + q[:, 1] * b2[..., 1]) - \
+            self.leakage * b1[..., 0] * b2[..., 0]
+        return np.where(self.edge_evidence >= 0, self.edge_evidence, 1 - free)
+
+    def get_marginals(self):
+        """P(True) of every flooding node (horizon x |V|) and every blockage (horizon x |E|) - NaN if impossible"""
+        if not self.possible:
+            return np.full(self.alpha.shape[:2], np.nan), np.full(self.edge_evidence.shape, np.nan)
+        flood_beliefs = self.get_flood_beliefs()
+        return flood_beliefs[..., 1], self.get_edge_marginals(flood_beliefs)
+
+    def get_proposal(self) -> np.ndarray:
+        """
+        (horizon x |V| x 2) importance sampling proposal for the flooding chains, from the backward messages:
+        P(Fl(v,t) | Fl(v,t-1) = x) for x = False, True (the prior at t=0, for both).
+        For impossible evidence - the flooding CPTs themselves
+        """
+        if not self.possible:
+            proposal = np.empty(self.alpha.shape)
+            proposal[0] = self.prior[:, None, 1]
+            proposal[1:] = self.transition[..., 1]
+            return proposal
+        evidence_below = self.flood_evidence * self.get_edge_products(*np.nonzero(self.edge_evidence >= 0)) * \
+            self.beta
+        proposal = np.empty(self.alpha.shape)
+        proposal[0] = normalize(self.prior * evidence_below[0])[:, None, 1]
+        proposal[1:] = normalize(self.transition[None] * evidence_below[1:, :, None, :])[..., 1]
+        return proposal
+
+    def query(self, queries: List[List[Literal]], evidence: List[Literal]) -> List[float]:
+        """
+        P(query | evidence) for each conjunction query, by the chain rule:
+        P(l1, l2, ... | e) = P(l1 | e) * P(l2 | e, l1) * ..., clamping every literal as evidence for the next.
+        All the first literals are answered by a single propagation
+        """
+        self.run(evidence)
+        base_marginals = self.get_marginals()
+        results = []
+        for query in queries:
+            probability, clamped = 1.0, list(evidence)
+            for k, literal in enumerate(query):
+                if k > 0:
+                    self.run(clamped)
+                marginals = base_marginals if k == 0 else self.get_marginals()
+                t, is_edge, i, value = literal
+                p_true = marginals[is_edge][t, i]
+                probability *= p_true if value else 1 - p_true
+                if not probability > 0:  # zero, or NaN (impossible evidence)
+                    break
+                clamped.append(literal)
+            results.append(float(probability))
+        return results
@@ -0,0 +1,44 @@
+import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from compiled_network import CompiledNetwork
+from sample_store import SampleStore
+
+_network: CompiledNetwork = None  # the network of the worker process, set once by the pool initializer
+
+
+def init_worker(network: CompiledNetwork):
+    global _network
+    _network = network
+
+
+def sample_shard(evidence: np.ndarray, n_samples: int, seed_sequence: np.random.SeedSequence):
+    """worker task - likelihood weighting of one shard, returned in packed form"""
+    rng = np.random.RandomState(np.random.MT19937(seed_sequence))
+    samples = _network.generate_samples(evidence, n_samples, rng)
+    return samples.bits, samples.weights
+
+
+class SamplingPool:
+    """
+    Likelihood weighting sharded over worker processes.
+    Each worker receives the compiled network once, and every shard gets a seed derived from (seed, shard index),
+    so the merged samples are reproducible for a given seed and number of workers.
+    """
+    def __init__(self, network: CompiledNetwork, workers: int):
+        self.network = network
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(network,))
+
+    def generate_samples(self, evidence: np.ndarray, n_samples: int, seed=0) -> SampleStore:
+        # an unseeded run derives its seed from the random module, like the single process sampling
+        root_seed = seed if seed != 0 else random.getrandbits(32)
+        seed_sequences = np.random.SeedSequence(root_seed).spawn(self.workers)
+        shard_sizes = [n_samples // self.workers + (i < n_samples % self.workers) for i in range(self.workers)]
+        futures = [self.executor.submit(sample_shard, evidence, size, seed_sequence)
+                   for size, seed_sequence in zip(shard_sizes, seed_sequences)]
+        shards = [SampleStore(*future.result(), self.network.n_nodes) for future in futures]
+        return SampleStore.concatenate(shards)
+
+    def shutdown(self):
+        self.executor.shutdown()
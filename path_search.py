@@ -0,0 +1,123 @@
+import heapq
+import itertools
+from collections import deque
+import numpy as np
+from typing import List, Dict, Tuple, Callable
+from sample_store import SampleStore
+from utils.data_structures import Graph, Node
+from utils.instrumentation import metrics
+
+
+class SamplesPathScorer:
+    """
+    Scores paths on a shared sample store.
+    The state of a partial path is the bit-packed mask of the samples in which all of its edges are free
+    """
+    def __init__(self, samples: SampleStore, edge_columns: Dict[str, int]):
+        """:param edge_columns: the sample store column of each edge's blockage node"""
+        self.samples = samples
+        self.edge_columns = edge_columns
+        self.total_weight = samples.total_weight()
+        self.free_masks: Dict[str, np.ndarray] = {}
+
+    def root(self):
+        return np.packbits(np.ones(len(self.samples), dtype=bool))
+
+    def extend(self, state, edge: str):
+        if edge not in self.free_masks:
+            self.free_masks[edge] = np.packbits(~self.samples.column(self.edge_columns[edge]))
+        return state & self.free_masks[edge]
+
+    def probability(self, state) -> float:
+        if self.total_weight == 0:
+            return 0.0
+        mask = np.unpackbits(state, count=len(self.samples)).astype(bool)
+        return float(self.samples.weights[mask].sum() / self.total_weight)
+
+
+class RaoBlackwellPathScorer:
+    """
+    Scores paths on a shared sample store, Rao-Blackwellized.
+    The state of a partial path is the probability, in each sample, that all of its edges are free given the sampled
+    flooding (edges are independent given the flooding)
+    """
+    def __init__(self, samples: SampleStore, free_probabilities: Callable[[str], np.ndarray]):
+        """:param free_probabilities: an edge's per-sample probability of being free"""
+        self.samples = samples
+        self.free_probabilities = free_probabilities
+        self.total_weight = samples.total_weight()
+        self.edge_factors: Dict[str, np.ndarray] = {}
+
+    def root(self):
+        return np.ones(len(self.samples))
+
+    def extend(self, state, edge: str):
+        if edge not in self.edge_factors:
+            self.edge_factors[edge] = self.free_probabilities(edge)
+        return state * self.edge_factors[edge]
+
+    def probability(self, state) -> float:
+        return float(self.samples.weights @ state / self.total_weight) if self.total_weight else 0.0
+
+
+class QueryPathScorer:
+    """Scores paths with a query per path, for engines without a shared sample store. The state is the path's edges"""
+    def __init__(self, free_path_probability: Callable[[List[str]], float]):
+        self.free_path_probability = free_path_probability
+
+    def root(self):
+        return ()
+
+    def extend(self, state, edge: str):
+        return state + (edge,)
+
+    def probability(self, state) -> float:
+        return self.free_path_probability(list(state)) if state else 1.0
+
+
+def get_hop_distances(graph: Graph, tgt: Node) -> Dict[Node, int]:
+    """BFS - number of edges in the shortest path from each vertex to tgt (unreachable vertices are omitted)"""
+    distances = {tgt: 0}
+    queue = deque([tgt])
+    while queue:
+        u = queue.popleft()
+        for v in graph.neighbours(u):
+            if v not in distances and not graph.get_edge(u, v).blocked:
+                distances[v] = distances[u] + 1
+                queue.append(v)
+    return distances
+
+
+def best_free_paths(graph: Graph, src: Node, tgt: Node, scorer, k=1, max_hops=None) -> List[Tuple[List[str], float]]:
+    """
+    Best-first branch and bound search for the k simple paths most likely to be free from blockages.
+    P(path is free) can only decrease when a path is extended, so the most probable partial path is expanded first,
+    and a complete path that reaches the top of the queue is at least as probable as every path not found yet.
+    Ties (common with sampled probabilities) are broken in favor of partial paths closer to the target, and partial
+    paths that can't reach the target within max_hops are pruned.
+    :param scorer: computes the free-path probability of partial paths, incrementally (root/extend/probability)
+    :param max_hops: maximal number of edges in a path (None - unlimited)
+    :return: up to k (edge labels, probability) pairs, most probable first
+    """
+    hops_to_tgt = get_hop_distances(graph, tgt)
+    if src not in hops_to_tgt:
+        return []
+    tie_breaker = itertools.count()
+    queue = [(-1.0, hops_to_tgt[src], next(tie_breaker), src, (src,), [], scorer.root())]
+    results = []
+    while queue and len(results) < k:
+        neg_probability, _, _, u, vertices, edges, state = heapq.heappop(queue)
+        metrics.count('path_search_expansions')
+        if u == tgt:
+            results.append((edges, -neg_probability))
+            continue
+        for v in sorted(graph.neighbours(u), key=str):
+            e = graph.get_edge(u, v)
+            if v in vertices or e.blocked or v not in hops_to_tgt:
+                continue
+            if max_hops is not None and len(edges) + 1 + hops_to_tgt[v] > max_hops:
+                continue
+            new_state = scorer.extend(state, e.label)
+            heapq.heappush(queue, (-scorer.probability(new_state), hops_to_tgt[v], next(tie_breaker), v,
+                                   vertices + (v,), edges + [e.label], new_state))
+    return results
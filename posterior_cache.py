@@ -0,0 +1,84 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Tuple, Hashable, Union
+
+QUERY_BYTES = 100  # approximate size of a memoized conjunction query result
+LITERAL_BYTES = 50  # approximate size of every literal in its key
+
+
+class Posterior:
+    """
+    The query results of one evidence state: the posterior marginals P(node = True | evidence) of all the nodes
+    (NaN where not computed yet), and the probabilities of the conjunction queries asked so far
+    """
+    def __init__(self, n_nodes: int):
+        self.marginals = np.full(n_nodes, np.nan)
+        self.conjunctions: Dict[Tuple[Tuple[int, bool], ...], float] = {}
+        self.samples = 0  # number of samples behind the results
+
+    def get(self, query: Tuple[Tuple[int, bool], ...]) -> Union[float, None]:
+        """:param query: (node, value) literals, sorted"""
+        if len(query) == 1:
+            node, value = query[0]
+            p_true = self.marginals[node]
+            if not np.isnan(p_true):
+                return float(p_true if value else 1 - p_true)
+        return self.conjunctions.get(query)
+
+    def set(self, query: Tuple[Tuple[int, bool], ...], probability: float):
+        if len(query) == 1:
+            node, value = query[0]
+            self.marginals[node] = probability if value else 1 - probability
+        else:
+            self.conjunctions[query] = probability
+
+    @property
+    def nbytes(self):
+        return self.marginals.nbytes + sum(QUERY_BYTES + LITERAL_BYTES * len(q) for q in self.conjunctions)
+
+
+class PosteriorCache:
+    """LRU cache of posteriors by evidence state, bounded by their total size"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: Dict[Hashable, Posterior] = OrderedDict()
+        self.sizes: Dict[Hashable, int] = {}  # of the entries, when last put
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Union[Posterior, None]:
+        """the posterior of the key (counted as a hit), or None (a miss)"""
+        posterior = self.entries.get(key)
+        if posterior is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return posterior
+
+    def peek(self, key: Hashable) -> Union[Posterior, None]:
+        """the posterior of the key, or None - without counting or reordering"""
+        return self.entries.get(key)
+
+    def put(self, key: Hashable, posterior: Posterior):
+        """(re)insert a posterior - also after it grew - evicting the least recently used ones while over the limit"""
+        if key in self.entries:
+            del self.entries[key]
+            self.nbytes -= self.sizes.pop(key)
+        if posterior.nbytes > self.max_bytes:
+            return
+        self.entries[key] = posterior
+        self.sizes[key] = posterior.nbytes
+        self.nbytes += self.sizes[key]
+        while self.nbytes > self.max_bytes:
+            evicted, _ = self.entries.popitem(last=False)
+            self.nbytes -= self.sizes.pop(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.nbytes = 0
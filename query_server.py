@@ -0,0 +1,182 @@
+import json
+import time
+import asyncio
+import itertools
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple
+from configurator import Configurator
+from hurricane_simulator import Simulator
+
+_simulator: Simulator = None  # the warm simulator of the worker process, set once by the pool initializer
+
+
+def get_config() -> Dict:
+    """the user configuration, to be recreated in the worker processes"""
+    return {k: v for k, v in vars(Configurator).items()
+            if not k.startswith('_') and isinstance(v, (bool, int, float, str, type(None)))}
+
+
+def init_worker(config: Dict):
+    global _simulator
+    for k, v in config.items():
+        setattr(Configurator, k, v)
+    Configurator.workers = 1  # the server's processes don't shard their sampling further
+    _simulator = Simulator()
+
+
+def evaluate_group(scenarios: List[Dict]) -> List[Dict]:
+    """worker task - evaluate scenarios with the same evidence, with one batched query evaluation"""
+    return list(_simulator.run_batch(scenarios))
+
+
+class QueryServer:
+    """
+    asyncio server of batch-mode scenarios (JSON lines over TCP) - one scenario per request line, one result line
+    per request. The networks are loaded once, in the worker processes, so the event loop never blocks on inference.
+    Requests with the same evidence are evaluated as one job: one set of samples and one batched query evaluation.
+    A job waits for the coalescing window, and then until a worker is idle, so the busier the server is, the more
+    requests every job answers
+    """
+    def __init__(self, workers: int, coalesce_window: float):
+        """:param coalesce_window: minimal seconds a job waits for more requests with the same evidence"""
+        self.workers = workers
+        self.idle_workers = workers
+        self.coalesce_window = coalesce_window
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(get_config(),))
+        # the requests of the jobs not dispatched yet (by evidence, oldest first)
+        self.pending: Dict[Tuple[str, ...], List[Tuple[Dict, asyncio.Future]]] = OrderedDict()
+        self.n_requests = 0
+        self.n_jobs = 0
+
+    @staticmethod
+    def get_evidence_key(scenario: Dict) -> Tuple[str, ...]:
+        """canonical (order and whitespace independent) evidence of a scenario"""
+        return tuple(sorted({str(e).replace(' ', '') for e in scenario.get('evidence', [])}))
+
+    async def answer(self, scenario: Dict) -> Dict:
+        self.n_requests += 1
+        key = self.get_evidence_key(scenario)
+        future = asyncio.get_running_loop().create_future()
+        if key not in self.pending:
+            self.pending[key] = []
+            asyncio.get_running_loop().call_later(self.coalesce_window, self.dispatch)
+        self.pending[key].append((scenario, future))
+        return await future
+
+    def dispatch(self):
+        """start the oldest pending jobs on the idle workers"""
+        while self.idle_workers and self.pending:
+            self.idle_workers -= 1
+            asyncio.ensure_future(self.run_job(self.pending.popitem(last=False)[1]))
+
+    async def run_job(self, group: List[Tuple[Dict, asyncio.Future]]):
+        self.n_jobs += 1
+        scenarios = [dict(scenario, id=i) for i, (scenario, _) in enumerate(group)]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, evaluate_group, scenarios)
+        except Exception as e:
+            results = [{'id': i, 'error': 'evaluation failed: {}'.format(e)} for i in range(len(group))]
+        finally:
+            self.idle_workers += 1
+            self.dispatch()
+        for result in results:
+            scenario, future = group[result['id']]
+            result.update(id=scenario.get('id'), coalesced=len(group))
+            future.set_result(result)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    scenario = json.loads(line)
+                except ValueError as e:
+                    result = {'error': 'invalid JSON: {}'.format(e)}
+                else:
+                    result = await self.answer(scenario)
+                writer.write((json.dumps(result) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def warm_up(self):
+        """load the network in every worker before serving"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, evaluate_group, []) for _ in range(self.workers)])
+
+    async def serve(self, host: str, port: int):
+        await self.warm_up()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print('serving on {}:{}'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+
+async def load_test(host: str, port: int, scenarios: List[Dict], n_requests: int, concurrency: int) -> Dict:
+    """
+    send n_requests requests (cycling through the scenarios) over concurrency connections, each sending its next
+    request when the previous one is answered
+    :return: latency percentiles (seconds), throughput and the average number of requests per coalesced job
+    """
+    latencies, coalesced, errors = [], [], 0
+    request_numbers = itertools.count()
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        while True:
+            i = next(request_numbers)
+            if i >= n_requests:
+                break
+            start_time = time.perf_counter()
+            writer.write((json.dumps(scenarios[i % len(scenarios)]) + '\n').encode())
+            await writer.drain()
+            result = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start_time)
+            errors += 'error' in result
+            coalesced.append(result.get('coalesced', 1))
+        writer.close()
+        await writer.wait_closed()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start_time
+    return {'requests': len(latencies),
+            'errors': errors,
+            'seconds': seconds,
+            'queries_per_second': len(latencies) / seconds if seconds > 0 else float('nan'),
+            'p50_latency': float(np.percentile(latencies, 50)) if latencies else float('nan'),
+            'p99_latency': float(np.percentile(latencies, 99)) if latencies else float('nan'),
+            'mean_coalesced': float(np.mean(coalesced)) if coalesced else float('nan')}
+
+
+def run_server():
+    server = QueryServer(Configurator.workers, Configurator.coalesce_window)
+    try:
+        asyncio.run(server.serve(Configurator.host, Configurator.port))
+    except KeyboardInterrupt:  # ^C pressed
+        pass
+    finally:
+        server.executor.shutdown()
+
+
+def run_load_test():
+    """load test a running server with the scenarios of the batch file"""
+    with open(Configurator.batch) as f:
+        scenarios = [json.loads(line) for line in f if line.strip()]
+    try:
+        report = asyncio.run(load_test(Configurator.host, Configurator.port, scenarios, Configurator.load_test,
+                                       Configurator.concurrency))
+    except ConnectionError:
+        print('no server on {}:{}'.format(Configurator.host, Configurator.port))
+        return None
+    print('{requests} requests ({errors} errors) in {seconds:.3f} seconds: {queries_per_second:.1f} queries/second, '
+          'latency p50 {p50_latency:.4f}s p99 {p99_latency:.4f}s, {mean_coalesced:.2f} requests per job'.format(
+           **report))
+    return report
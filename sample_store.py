@@ -0,0 +1,150 @@
+import numpy as np
+from typing import List
+
+EVALUATION_CHUNK_BYTES = 2 ** 24  # max size of the per-chunk literal matrices used by match_weights
+
+
+class SampleStore:
+    """
+    Compact store of weighted samples.
+    Each sample is a bit-packed row (n_nodes/8 bytes), where the node with ordinal i is bit i of the row.
+    """
+    def __init__(self, bits: np.ndarray, weights: np.ndarray, n_nodes: int):
+        self.bits = bits
+        self.weights = weights
+        self.n_nodes = n_nodes
+
+    @staticmethod
+    def from_matrix(X: np.ndarray, weights: np.ndarray):
+        """:param X: (n_samples x n_nodes) boolean samples matrix"""
+        return SampleStore(np.packbits(X, axis=1), weights, X.shape[1])
+
+    @staticmethod
+    def concatenate(stores: List):
+        return SampleStore(np.concatenate([s.bits for s in stores]),
+                           np.concatenate([s.weights for s in stores]),
+                           stores[0].n_nodes)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __getitem__(self, mask):
+        return SampleStore(self.bits[mask], self.weights[mask], self.n_nodes)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes + self.weights.nbytes
+
+    def total_weight(self):
+        return self.weights.sum()
+
+    def column(self, i) -> np.ndarray:
+        """the values of node i in all the samples"""
+        return (self.bits[:, i >> 3] >> (7 - (i & 7))) & 1 == 1
+
+    def columns(self, nodes) -> np.ndarray:
+        """(n_samples x len(nodes)) boolean matrix of the nodes' values"""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return (self.bits[:, nodes >> 3] >> (7 - (nodes & 7))) & 1 == 1
+
+    def with_column(self, i, value: bool):
+        """a copy in which node i has the given value in all the samples"""
+        bits = self.bits.copy()
+        bit = np.uint8(1 << (7 - (i & 7)))
+        bits[:, i >> 3] = bits[:, i >> 3] | bit if value else bits[:, i >> 3] & ~bit
+        return SampleStore(bits, self.weights, self.n_nodes)
+
+    def effective_sample_size(self):
+        """(sum of weights)^2 / (sum of squared weights)"""
+        squares = np.square(self.weights).sum()
+        return self.weights.sum() ** 2 / squares if squares > 0 else 0.0
+
+    def to_matrix(self):
+        return np.unpackbits(self.bits, axis=1, count=self.n_nodes).astype(bool)
+
+    def consistent_with(self, nodes, values) -> np.ndarray:
+        """mask of the samples in which every node has the given value. Compares whole bytes of the packed rows"""
+        match = np.ones(len(self), dtype=bool)
+        nodes = np.asarray(nodes, dtype=np.int64)
+        values = np.asarray(values, dtype=bool)
+        byte_idx = nodes >> 3
+        bit = (1 << (7 - (nodes & 7))).astype(np.uint8)
+        for b in np.unique(byte_idx):
+            in_byte = byte_idx == b
+            byte_mask = np.bitwise_or.reduce(bit[in_byte])
+            byte_value = np.bitwise_or.reduce(np.where(values[in_byte], bit[in_byte], 0).astype(np.uint8))
+            match &= (self.bits[:, b] & byte_mask) == byte_value
+        return match
+
+    def match_weights(self, nodes, values, incidence: np.ndarray, leaf_cpts=None, square_matches=False) -> np.ndarray:
+        """
+        Batched query evaluation - the weight of the samples matching each query, in one pass over the samples.
+        A query is a conjunction of literals (node = value).
+        :param nodes, values: the literals, without duplicates
+        :param incidence: (n_literals x n_queries) 0/1 matrix of the literals of each query
+        :param leaf_cpts: Rao-Blackwellization - (literal positions, parents, cpt) of literals of unobserved leaf nodes.
+                          These literals count by their probability given their parents in the sample instead of 0/1
+                          (leaves are independent given all the other nodes, so the probabilities multiply)
+        :param square_matches: sum weight * match^2 instead of weight * match (for variance estimation)
+        :return: the matching weight of each query
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        values = np.asarray(values, dtype=bool)
+        incidence = np.asarray(incidence, dtype=np.float32)
+        query_sizes = incidence.sum(axis=0)
+        # single literal queries (marginals) need no product: the literal column is the match column
+        single_literals = np.argmax(incidence, axis=0) if (query_sizes == 1).all() else None
+        match_weights = np.zeros(incidence.shape[1], dtype=np.float64)
+        chunk_size = max(1, EVALUATION_CHUNK_BYTES // (8 * max(1, len(nodes) + incidence.shape[1])))
+        for start in range(0, len(self), chunk_size):
+            chunk = self[start:start + chunk_size]
+            literals = chunk.columns(nodes) == values
+            if leaf_cpts is not None:
+                literals = literals.astype(np.float64)
+                literals[:, leaf_cpts[0]] = chunk.get_leaf_probabilities(values[leaf_cpts[0]], *leaf_cpts[1:])
+            if single_literals is not None:
+                matches = literals[:, single_literals]
+            elif leaf_cpts is None:
+                # number of satisfied literals of each query - a query matches if all of its literals are satisfied
+                matches = literals.astype(np.float32) @ incidence == query_sizes
+            else:
+                # product of the literals' factors of each query, as a sum of logs
+                has_zero = (literals == 0).astype(np.float32) @ incidence > 0
+                log_product = np.log(np.where(literals > 0, literals, 1)) @ incidence.astype(np.float64)
+                matches = np.where(has_zero, 0, np.exp(log_product))
+            if square_matches:
+                matches = np.square(matches, dtype=np.float64)
+            match_weights += chunk.weights @ matches
+        return match_weights
+
+    def marginal_weights(self, leaf_cpts=None) -> np.ndarray:
+        """
+        the weight of the samples in which each node is True, for all the nodes in one pass over the samples
+        :param leaf_cpts: Rao-Blackwellization - (nodes, parents, cpt) of unobserved leaf nodes, counted by their
+                          probability of being True given their parents in the sample
+        """
+        true_weights = np.zeros(self.n_nodes)
+        leaf_weights = np.zeros(0 if leaf_cpts is None else len(leaf_cpts[0]))
+        chunk_size = max(1, EVALUATION_CHUNK_BYTES // (8 * max(1, self.n_nodes)))
+        for start in range(0, len(self), chunk_size):
+            chunk = self[start:start + chunk_size]
+            true_weights += chunk.weights @ chunk.to_matrix()
+            if leaf_cpts is not None:
+                leaf_weights += chunk.weights @ chunk.get_leaf_probabilities(True, *leaf_cpts[1:])
+        if leaf_cpts is not None:
+            true_weights[leaf_cpts[0]] = leaf_weights
+        return true_weights
+
+    def get_leaf_probabilities(self, values, parents: np.ndarray, cpt: np.ndarray) -> np.ndarray:
+        """
+        :param parents: (n_leaves x max parents) the leaves' parents, padded with -1
+        :param cpt: (n_leaves x 2^max parents) P(leaf = True | parents assignment)
+        :return: (n_samples x n_leaves) P(leaf = value | its parents values in the sample)
+        """
+        assignment = np.zeros((len(self), len(parents)), dtype=np.int64)
+        for k in range(parents.shape[1]):
+            has_parent = parents[:, k] >= 0
+            parent_values = self.columns(np.where(has_parent, parents[:, k], 0))
+            assignment = np.where(has_parent, assignment * 2 + parent_values, assignment)
+        p_true = cpt[np.arange(len(parents)), assignment]
+        return np.where(values, p_true, 1 - p_true)
@@ -1,7 +1,25 @@
 from hurricane_simulator import Simulator
 from configurator import Configurator
+from query_server import run_server, run_load_test
+from utils.instrumentation import profile
+
+
+def main():
+    if Configurator.serve:
+        run_server()
+    elif Configurator.load_test:
+        run_load_test()
+    else:
+        sim = Simulator()
+        if Configurator.batch:
+            sim.run_batch_file(Configurator.batch, Configurator.output)
+        else:
+            sim.query_network()
+
 
 if __name__ == '__main__':
     Configurator.get_user_config()
-    sim = Simulator()
-    sim.query_network()
+    if Configurator.profile:
+        profile(main, Configurator.profile)
+    else:
+        main()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)  # the tests import the repo's top-level modules
+BASIC_CONFIG = os.path.join(REPO_DIR, 'tests', 'basic.config')
+
+
+def configure(*args):
+    """set the user configuration from command line arguments, as test.py would"""
+    import io
+    import contextlib
+    from configurator import Configurator
+    argv = sys.argv
+    sys.argv = ['test.py', '--cache_size', '0'] + [str(a) for a in args]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            Configurator.get_user_config()
+    finally:
+        sys.argv = argv
+    return Configurator
@@ -0,0 +1,31 @@
+import numpy as np
+from conftest import BASIC_CONFIG, configure
+
+
+def get_flood_marginals(engine: str, evidence):
+    Configurator = configure('-g', BASIC_CONFIG, '-T', 2, '-e', engine)
+    from hurricane_simulator import Simulator
+    from bayes_network import FloodBNNode
+    sim = Simulator()
+    for raw_evidence in evidence:
+        sim.BN.add_evidence(*sim.parse_evidence(raw_evidence))
+    queries = [{v: True} for v in sim.BN.top_sorted_V if isinstance(v, FloodBNNode)]
+    return np.array([p for _, _, p in sim.BN.sample_queries(queries, verbose=False)]), sim.BN
+
+
+def test_impossible_evidence():
+    """V3 never floods, so F(V3,1) is impossible - NaN for every query, like the other engines, without iterating"""
+    from utils.instrumentation import metrics
+    marginals, _ = get_flood_marginals('lbp', ['F(V3,1)', 'B(E1,0)'])
+    assert np.isnan(marginals).all()
+    assert metrics.gauges['lbp_iterations'] == 0
+    exact, _ = get_flood_marginals('exact', ['F(V3,1)', 'B(E1,0)'])
+    assert np.isnan(exact).all()
+
+
+def test_possible_evidence():
+    evidence = ['F(V1,1)', 'B(E2,0)', '~B(E4,1)']
+    marginals, _ = get_flood_marginals('lbp', evidence)
+    exact, _ = get_flood_marginals('exact', evidence)
+    assert np.isfinite(marginals).all()
+    assert np.abs(marginals - exact).max() < 0.05
@@ -0,0 +1,124 @@
+import heapq
+import random
+import pytest
+from utils.data_structures import Heap, Queue, Node, Edge, Graph, DirectedGraph
+
+CHAIN_LENGTH = 10 ** 6  # far beyond the recursion limit
+DAG_SIZE = 10 ** 5
+GRAPH_SIZE = 10 ** 5
+
+
+def get_random_dag(n: int, rng: random.Random, parents=3):
+    """nodes added in random order, each node with edges from up to `parents` earlier (by creation) nodes"""
+    V = [Node('u{}'.format(i)) for i in range(n)]
+    edges = {(V[rng.randrange(i)], V[i]) for i in range(1, n) for _ in range(parents)}
+    shuffled = V[:]
+    rng.shuffle(shuffled)
+    return DirectedGraph(shuffled, [Edge(u, v, directed=True) for u, v in edges]), edges
+
+
+def assert_topological(order, vertices, edges):
+    position = {v: i for i, v in enumerate(order)}
+    assert len(order) == len(vertices) and set(position) == set(vertices)
+    assert all(position[u] < position[v] for u, v in edges)
+
+
+def test_topological_sort_long_chain():
+    V = [Node('v{}'.format(i)) for i in range(CHAIN_LENGTH)]
+    G = DirectedGraph(V[::-1], [Edge(V[i], V[i + 1], directed=True) for i in range(CHAIN_LENGTH - 1)])
+    assert G.topological_sort() == V
+
+
+def test_topological_sort_random_dag():
+    G, edges = get_random_dag(DAG_SIZE, random.Random(1))
+    order = G.topological_sort()
+    assert_topological(order, list(G.get_vertices()), edges)
+    assert G.topological_sort() == order  # deterministic
+
+
+def test_topological_sort_cycle():
+    V = [Node('c{}'.format(i)) for i in range(3)]
+    G = DirectedGraph(V, [Edge(V[i], V[(i + 1) % 3], directed=True) for i in range(3)])
+    with pytest.raises(Exception, match='cycle'):
+        G.topological_sort()
+
+
+def test_heap_extract_order():
+    rng = random.Random(2)
+    keys = [rng.random() for _ in range(GRAPH_SIZE)]
+    heap = Heap(keys[:GRAPH_SIZE // 2])
+    heap.insert_many(keys[GRAPH_SIZE // 2:])
+    assert heap.is_min_heap() and len(heap) == GRAPH_SIZE
+    assert [heap.extract_min() for _ in range(GRAPH_SIZE)] == sorted(keys)
+    assert heap.is_empty()
+
+
+def test_heap_decrease_key():
+    """decreasing random keys, against heapq with lazy deletion of the outdated entries"""
+    rng = random.Random(3)
+    V = [Node('h{}'.format(i)) for i in range(GRAPH_SIZE)]
+    for v in V:
+        v.d = rng.random()
+    heap = Heap(V)
+    reference = [(v.d, i) for i, v in enumerate(V)]
+    heapq.heapify(reference)
+    for _ in range(GRAPH_SIZE):
+        i = rng.randrange(GRAPH_SIZE)
+        V[i].d *= rng.random()
+        heap.decrease_key(V[i])
+        heapq.heappush(reference, (V[i].d, i))
+    assert heap.is_min_heap()
+    extracted = []
+    while reference:
+        d, i = heapq.heappop(reference)
+        if d == V[i].d and V[i] in heap:
+            extracted.append(heap.extract_min())
+            assert extracted[-1].d == d
+    assert heap.is_empty() and len(extracted) == GRAPH_SIZE
+
+
+def test_queue_fifo():
+    queue = Queue()
+    for i in range(GRAPH_SIZE):
+        queue.push(i)
+    assert [queue.pop() for _ in range(GRAPH_SIZE)] == list(range(GRAPH_SIZE))
+    assert queue.is_empty()
+    with pytest.raises(Exception):
+        queue.pop()
+
+
+def get_distances(s, neighbours) -> dict:
+    """reference Dijkstra - heapq with lazy deletion"""
+    distances = {s: 0}
+    frontier = [(0, 0, s)]
+    pushes = 1
+    while frontier:
+        d, _, u = heapq.heappop(frontier)
+        if d > distances[u]:
+            continue
+        for v, w in neighbours[u]:
+            if d + w < distances.get(v, float('inf')):
+                distances[v] = d + w
+                heapq.heappush(frontier, (d + w, pushes, v))
+                pushes += 1
+    return distances
+
+
+def test_dijkstra():
+    rng = random.Random(4)
+    V = [Node('w{}'.format(i)) for i in range(GRAPH_SIZE)]
+    V.append(Node('unreachable'))
+    weights = {}
+    for i in range(1, GRAPH_SIZE):
+        for _ in range(2):
+            weights[V[rng.randrange(i)], V[i]] = rng.randint(1, 9)
+    G = Graph(V, [Edge(u, v, w) for (u, v), w in weights.items()])
+    neighbours = {v: [] for v in V}
+    for (u, v), w in weights.items():
+        neighbours[u].append((v, w))
+        neighbours[v].append((u, w))
+    G.dijkstra(V[0])
+    distances = get_distances(V[0], neighbours)
+    assert all(v.d == distances.get(v, float('inf')) for v in V)
+    assert all(v.prev is None or v.prev.d + G.get_edge(v.prev, v).w == v.d for v in V)
+    assert list(G.get_shortest_path(V[0], V[-2]))[0] is V[0]
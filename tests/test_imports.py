@@ -0,0 +1,27 @@
+import sys
+import json
+import subprocess
+from conftest import REPO_DIR
+
+MAX_IMPORT_SECONDS = 0.8  # about 0.3 seconds without networkx and matplotlib, 1 second with them
+IMPORT_SCRIPT = 'import sys, time, json; start_time = time.perf_counter(); ' \
+                'import hurricane_simulator, bayes_network, test; ' \
+                'print(json.dumps({"seconds": time.perf_counter() - start_time, ' \
+                '"modules": [m for m in ("networkx", "matplotlib") if m in sys.modules]}))'
+
+
+def import_in_subprocess():
+    """import the simulator in a fresh interpreter. :return: the import seconds and the display modules it loaded"""
+    process = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPO_DIR, capture_output=True, text=True,
+                             check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def test_no_display_modules_imported():
+    assert import_in_subprocess()['modules'] == []
+
+
+def test_import_time():
+    # best of 3, so a slow moment of the machine doesn't fail the test
+    seconds = min(import_in_subprocess()['seconds'] for _ in range(3))
+    assert seconds < MAX_IMPORT_SECONDS
@@ -1,45 +1,86 @@
 import os
 import heapq
-import networkx as nx
-import matplotlib.pyplot as plt
-from heapq import _siftdown
-from typing import List, Dict, Tuple
+from collections import deque
+from typing import List, Dict, Tuple, Iterable
 
 
 class Heap:
-    def __init__(self, elements: List=[]):
-        heapq.heapify(elements)
-        self.heap = elements
-        self.set = set(elements)
+    """binary min-heap with a map of its elements positions, so membership is O(1) and decrease_key O(log n)"""
+    def __init__(self, elements: Iterable=()):
+        self.heap = list(elements)
+        heapq.heapify(self.heap)
+        self.position = {element: i for i, element in enumerate(self.heap)}
+
+    def __contains__(self, element):
+        return element in self.position
+
+    def __len__(self):
+        return len(self.heap)
 
     def insert(self, element):
-        heapq.heappush(self.heap, element)
-        self.set.add(element)
+        self.heap.append(element)
+        self.siftdown(len(self.heap) - 1)
 
     def insert_many(self, elements):
         for element in elements:
             self.insert(element)
 
     def extract_min(self):
-        min_item = heapq.heappop(self.heap)
-        self.set.remove(min_item)
+        last_item = self.heap.pop()
+        if not self.heap:
+            min_item = last_item
+        else:
+            min_item = self.heap[0]
+            self.heap[0] = last_item
+            self.siftup(0)
+        del self.position[min_item]
         return min_item
 
     def is_empty(self):
         return len(self.heap) == 0
 
     def is_min_heap(self):
-        return all(self.heap[i] >= self.heap[(i - 1) // 2] for i in range(1, len(self.heap)))
+        return all(not self.heap[i] < self.heap[(i - 1) // 2] for i in range(1, len(self.heap)))
 
     def siftdown(self, pos):
-        _siftdown(self.heap, 0, pos)
+        """move the element at pos up towards the root while it's smaller than its parent (heapq's naming)"""
+        heap = self.heap
+        item = heap[pos]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if not item < parent:
+                break
+            heap[pos] = parent
+            self.position[parent] = pos
+            pos = parent_pos
+        heap[pos] = item
+        self.position[item] = pos
+
+    def siftup(self, pos):
+        """move the element at pos down towards the leaves while it's larger than its smaller child"""
+        heap = self.heap
+        n = len(heap)
+        item = heap[pos]
+        child_pos = 2 * pos + 1
+        while child_pos < n:
+            if child_pos + 1 < n and heap[child_pos + 1] < heap[child_pos]:
+                child_pos += 1
+            if not heap[child_pos] < item:
+                break
+            heap[pos] = heap[child_pos]
+            self.position[heap[pos]] = pos
+            pos = child_pos
+            child_pos = 2 * pos + 1
+        heap[pos] = item
+        self.position[item] = pos
 
     def decrease_key(self, item):
-        idx = self.heap.index(item)
-        _siftdown(self.heap, 0, idx)
+        """restore the heap order after the item's key decreased"""
+        self.siftdown(self.position[item])
 
     def __str__(self):
-        return str([str(e) for e in self.set])
+        return str([str(e) for e in self.heap])
 
 
 class Stack:
@@ -60,39 +101,53 @@ class Stack:
 
 
 class Queue(Stack):
-    def push(self, element):
-        self.items.insert(0, element)
+    def __init__(self):
+        self.items = deque()
+
+    def pop(self):
+        try:
+            return self.items.popleft()
+        except:
+            raise Exception("Error: {} empty!!".format(self.__class__.__name__))
 
 
 ## GRAPH ##
-class Node:
-    """A base Node class for nodes used in the Graph class"""
+class LabeledNode:
+    """
+    A base class of graph nodes - only a label.
+    Slotted (no per-instance dict), and hashed and compared by identity - a node is equal only to itself, so dict
+    lookups don't hash or compare label strings. Look nodes up by label through the graph or the network
+    """
+    __slots__ = ('label',)
 
     def __init__(self, label):
         self.label = label
-        # Topology Sort algorithm aux variables:
-        self.visited = False
-        # Dijkstra algorithm aux variables:
-        self.d = 0
-        self.prev = None
 
     def __str__(self):
         return self.label
 
-    def __eq__(self, other):
-        return str(self) == str(other)
+    def __repr__(self):
+        return self.label
 
-    def __lt__(self, other):
-        return self.d < other.d
 
-    def __hash__(self):
-        return hash(self.label)
+class Node(LabeledNode):
+    """A base Node class for nodes used in the Graph class (road graph vertices), with the Dijkstra fields"""
+    __slots__ = ('d', 'prev')
 
-    def __repr__(self):
-        return self.label
+    def __init__(self, label):
+        super().__init__(label)
+        # Dijkstra algorithm aux variables:
+        self.d = 0
+        self.prev = None
+
+    def __lt__(self, other):
+        return self.d < other.d
 
 
 class Edge:
+    """slotted, and hashed and compared by identity (like Node)"""
+    __slots__ = ('label', 'v1', 'v2', 'w', 'blocked')
+
     def __init__(self, v1: Node, v2: Node, w=1, label='', directed=False):
         """edge created lexicographically by its vertices names, except when graph is directed"""
         if v2 < v1 and not directed:
@@ -102,23 +157,16 @@ class Edge:
         self.v2 = v2
         self.w = w
         self.blocked = False
-        self.deadline = float('inf')
 
     def get(self):
         return self.v1, self.v2, self.w
 
-    def __eq__(self, other):
-        return self.v1 == other.v1 and self.v2 == other.v2
-
     def __str__(self):
         return str((self.v1.label, self.v2.label, self.w))
 
     def __repr__(self):
         return '({},{})'.format(self.v1.label, self.v2.label)
 
-    def __hash__(self):
-        return hash((self.v1, self.v2))
-
 
 class Graph:
     """Graph with blockable edges"""
@@ -171,43 +219,16 @@ class Graph:
     def get_edges(self):
         return self.Adj.values()
 
-    def get_display_graph(self):
-        return nx.Graph()
-
-    def get_layout(self, G):
-        return nx.spring_layout(G, scale=25)
-
+    # networkx and matplotlib are imported on demand, so the inference doesn't pay for them
     def get_simple_paths(self, src, tgt):
-        paths = []
-        V = self.get_vertices()
-        G = nx.Graph()
-        G.add_nodes_from(V)
-        G.add_weighted_edges_from([e.get() for e in self.Adj.values() if not e.blocked])
-        for path in nx.all_simple_paths(G, source=src, target=tgt):
-            path_edges = list(zip(path, path[1:]))
-            paths.append([self.Adj[e].label for e in path_edges])
-        return paths
+        from utils.visualization import get_simple_paths
+        from utils.instrumentation import metrics
+        with metrics.timer('simple_paths'):
+            return get_simple_paths(self, src, tgt)
 
     def display(self, graph_id=0):
-        V = self.get_vertices()
-        G = self.get_display_graph()
-        G.add_nodes_from(V)
-        G.add_weighted_edges_from([e.get() for e in self.Adj.values() if not e.blocked])
-        node_labels = {v: str(v) for v in G.nodes()}
-        if G.number_of_nodes() == 0:
-            return
-        if self.pos is None:
-            # save node position to maintain the same graph layout throughout simulations
-            self.pos = self.get_layout(G)
-        if not isinstance(self, DirectedGraph):
-            edge_labels = {k: '{},w={}'.format(e.label, e.w) for k, e in self.Adj.items()}
-            nx.draw_networkx_edge_labels(G, self.pos, edge_labels=edge_labels, rotate=False, font_size=6)
-
-        nx.draw(G, self.pos, node_size=1700, with_labels=False)
-        nx.draw_networkx_labels(G, self.pos, node_labels, font_size=7.5, font_weight='bold')
-        plt.margins(0.2)
-        plt.legend([], title=graph_id, loc='upper center')
-        plt.show()
+        from utils.visualization import display
+        display(self, graph_id)
 
     @staticmethod
     def shortest_path_successor(src, target):
@@ -248,12 +269,12 @@ class Graph:
             v.d = inf
             v.prev = None
         s.d = 0
-        Q = Heap(list(V))
+        Q = Heap(V)
         while not Q.is_empty():
             u = Q.extract_min()
             if debug: self.display(str(Q) + '; u = ' + u.label)
             for v in self.neighbours(u):
-                if v in Q.set:
+                if v in Q:
                     if debug: self.display(str(Q) + '; u = ' + u.label + ', v = ' + v.label)
                     val = u.d + self.Adj[u, v].w  # w(u,v)
                     if val < v.d:
@@ -270,31 +291,28 @@ class DirectedGraph(Graph):
         self.V[v1].add(v2)
         self.Adj[v1, v2] = e
 
-    def get_display_graph(self):
-        return nx.DiGraph()
-
-    def get_layout(self, G):
-        return nx.spectral_layout(G, scale=25)
-
-    # Topology Sort #
-    # Reference: geeksforgeeks.org
-    def topological_sort_rec(self, v: Node, stack: Stack):
-        v.visited = True          # Mark the current node as visited.
-        # recursive step for all v's neighbours
-        for u in self.neighbours(v):
-            if not u.visited:
-                self.topological_sort_rec(u, stack)
-        stack.push(v)
-
-    def topological_sort_init(self):
-        for v in self.get_vertices():
-            v.visited = False
-
-    def topological_sort(self):
-        self.topological_sort_init()
-        stack = Stack()
-        # Call the recursive helper function to store Topological Sort starting from all vertices one by one
-        for v in self.get_vertices():
-            if not v.visited:
-                self.topological_sort_rec(v, stack)
-        return list(reversed(stack.items))
+    def topological_sort(self) -> List[Node]:
+        """
+        Kahn's algorithm - iterative (no recursion limit on long chains), and without marking the nodes.
+        Of the nodes ready, the one added to the graph first comes first, so the order is deterministic
+        """
+        vertices = list(self.get_vertices())
+        position = {v: i for i, v in enumerate(vertices)}
+        # the children by position, so the loop below doesn't hash nodes
+        children = [[position[u] for u in adjacent] for adjacent in self.V.values()]
+        in_degree = [0] * len(vertices)
+        for v_children in children:
+            for i in v_children:
+                in_degree[i] += 1
+        ready = [i for i, degree in enumerate(in_degree) if degree == 0]  # ascending - already a heap
+        order = []
+        while ready:
+            i = heapq.heappop(ready)
+            order.append(vertices[i])
+            for j in children[i]:
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    heapq.heappush(ready, j)
+        if len(order) < len(vertices):
+            raise Exception("the graph has a cycle")
+        return order
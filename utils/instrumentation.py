@@ -0,0 +1,80 @@
+import io
+import time
+import json
+import pstats
+import cProfile
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Callable, Dict
+
+PROFILE_LINES = 40  # functions listed in a profile report
+
+
+class Metrics:
+    """
+    Process-wide instrumentation of the inference phases: timers (total seconds and calls per phase),
+    counters (e.g. samples drawn, queries evaluated) and gauges (the last value of e.g. the effective sample size).
+    Phases may nest, each timer counts its own wall time
+    """
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, float] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+
+    @contextmanager
+    def timer(self, phase: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - start_time
+            self.calls[phase] += 1
+
+    def timed(self, phase: str):
+        """decorator - time every call of the function as the phase"""
+        def decorator(function: Callable):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, counter: str, n=1):
+        self.counters[counter] += n
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.gauges.clear()
+
+    def as_dict(self) -> Dict:
+        return {'phases': {phase: {'seconds': self.seconds[phase], 'calls': self.calls[phase]}
+                           for phase in sorted(self.seconds, key=self.seconds.get, reverse=True)},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges)}
+
+
+metrics = Metrics()
+
+
+def profile(function: Callable, report_path: str, *args, **kwargs):
+    """
+    run the function under cProfile, and write a report: the metrics, and the functions with the most cumulative
+    time. The report is written also if the run is ended by exit() or ^C
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        with open(report_path, 'w') as f:
+            f.write('metrics:\n{}\n\n'.format(json.dumps(metrics.as_dict(), indent=2)))
+            f.write(stream.getvalue())
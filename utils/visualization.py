@@ -0,0 +1,45 @@
+import networkx as nx
+import matplotlib.pyplot as plt
+from utils.data_structures import Graph, DirectedGraph
+
+
+def get_display_graph(graph: Graph):
+    return nx.DiGraph() if isinstance(graph, DirectedGraph) else nx.Graph()
+
+
+def get_layout(graph: Graph, G):
+    return nx.spectral_layout(G, scale=25) if isinstance(graph, DirectedGraph) else nx.spring_layout(G, scale=25)
+
+
+def get_simple_paths(graph: Graph, src, tgt):
+    paths = []
+    V = graph.get_vertices()
+    G = nx.Graph()
+    G.add_nodes_from(V)
+    G.add_weighted_edges_from([e.get() for e in graph.Adj.values() if not e.blocked])
+    for path in nx.all_simple_paths(G, source=src, target=tgt):
+        path_edges = list(zip(path, path[1:]))
+        paths.append([graph.Adj[e].label for e in path_edges])
+    return paths
+
+
+def display(graph: Graph, graph_id=0):
+    V = graph.get_vertices()
+    G = get_display_graph(graph)
+    G.add_nodes_from(V)
+    G.add_weighted_edges_from([e.get() for e in graph.Adj.values() if not e.blocked])
+    node_labels = {v: str(v) for v in G.nodes()}
+    if G.number_of_nodes() == 0:
+        return
+    if graph.pos is None:
+        # save node position to maintain the same graph layout throughout simulations
+        graph.pos = get_layout(graph, G)
+    if not isinstance(graph, DirectedGraph):
+        edge_labels = {k: '{},w={}'.format(e.label, e.w) for k, e in graph.Adj.items()}
+        nx.draw_networkx_edge_labels(G, graph.pos, edge_labels=edge_labels, rotate=False, font_size=6)
+
+    nx.draw(G, graph.pos, node_size=1700, with_labels=False)
+    nx.draw_networkx_labels(G, graph.pos, node_labels, font_size=7.5, font_weight='bold')
+    plt.margins(0.2)
+    plt.legend([], title=graph_id, loc='upper center')
+    plt.show()
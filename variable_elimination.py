@@ -0,0 +1,117 @@
+import numpy as np
+from typing import List, Dict, Tuple
+from compiled_network import CompiledNetwork
+
+
+class Factor:
+    """A function over binary variables, stored as an array with one axis (of size 2) per variable"""
+    def __init__(self, variables: Tuple[int, ...], table: np.ndarray):
+        self.variables = variables
+        self.table = table
+
+    def reduce(self, assignment: Dict[int, int]):
+        """restrict the factor to the assigned values of its variables"""
+        if not any(v in assignment for v in self.variables):
+            return self
+        index = tuple(assignment.get(v, slice(None)) for v in self.variables)
+        return Factor(tuple(v for v in self.variables if v not in assignment), self.table[index])
+
+    def expand(self, variables: Tuple[int, ...]):
+        """the factor's table, broadcastable over the given variables (a superset of the factor's variables)"""
+        perm = [self.variables.index(v) for v in variables if v in self.variables]
+        shape = [2 if v in self.variables else 1 for v in variables]
+        return self.table.transpose(perm).reshape(shape)
+
+    def multiply(self, other):
+        variables = self.variables + tuple(v for v in other.variables if v not in self.variables)
+        return Factor(variables, self.expand(variables) * other.expand(variables))
+
+    def sum_out(self, variable: int):
+        axis = self.variables.index(variable)
+        return Factor(self.variables[:axis] + self.variables[axis + 1:], self.table.sum(axis=axis))
+
+
+class VariableElimination:
+    """Exact inference over a compiled Bayes Network, using variable elimination with a min-fill order"""
+    def __init__(self, network: CompiledNetwork):
+        self.network = network
+        self.factors: List[Factor] = [self.get_cpt_factor(i) for i in range(network.n_nodes)]
+
+    def get_cpt_factor(self, i):
+        """the factor P(node | parents) over (parents..., node)"""
+        n_parents = self.network.n_parents[i]
+        parents = tuple(int(p) for p in self.network.parents[i, :n_parents])
+        p_true = self.network.cpt[i, :2 ** n_parents].reshape((2,) * n_parents)
+        return Factor(parents + (i,), np.stack([1 - p_true, p_true], axis=-1))
+
+    def get_ancestors(self, nodes):
+        """the nodes and their ancestors. All the other nodes are barren - their factors sum to 1"""
+        ancestors = set()
+        stack = list(nodes)
+        while stack:
+            v = stack.pop()
+            if v not in ancestors:
+                ancestors.add(v)
+                stack.extend(int(p) for p in self.network.parents[v, :self.network.n_parents[v]])
+        return ancestors
+
+    @staticmethod
+    def get_elimination_order(factors: List[Factor], variables):
+        """
+        Greedy min-fill order (ties broken by min-degree):
+        eliminate first the variable whose elimination adds the fewest edges to the interaction graph
+        """
+        neighbours: Dict[int, set] = {v: set() for v in variables}
+        for f in factors:
+            for v in f.variables:
+                if v in neighbours:
+                    neighbours[v].update(u for u in f.variables if u != v and u in neighbours)
+
+        def score(v):
+            nbrs = list(neighbours[v])
+            fill = sum(1 for i, u in enumerate(nbrs) for w in nbrs[i + 1:] if w not in neighbours[u])
+            return fill, len(nbrs)
+
+        scores = {v: score(v) for v in neighbours}
+        order = []
+        while scores:
+            v = min(scores, key=scores.get)
+            order.append(v)
+            nbrs = neighbours.pop(v)
+            del scores[v]
+            for u in nbrs:
+                neighbours[u].discard(v)
+                neighbours[u].update(w for w in nbrs if w != u)
+            for u in nbrs:
+                scores[u] = score(u)
+        return order
+
+    def joint_probability(self, assignment: Dict[int, int]) -> float:
+        """P(assignment), by summing out all the unassigned relevant variables"""
+        relevant = self.get_ancestors(assignment.keys())
+        factors = [self.factors[i].reduce(assignment) for i in sorted(relevant)]
+        for v in self.get_elimination_order(factors, relevant - set(assignment)):
+            bucket = [f for f in factors if v in f.variables]
+            factors = [f for f in factors if v not in f.variables]
+            product = bucket[0]
+            for f in bucket[1:]:
+                product = product.multiply(f)
+            factors.append(product.sum_out(v))
+        return float(np.prod([f.table for f in factors]))
+
+    def query(self, queries: List[Tuple[List[int], List[bool]]], evidence: Dict[int, int]) -> List[float]:
+        """
+        :param queries: (node ordinals, values) of each query
+        :param evidence: {node ordinal: value}
+        :return: P(query | evidence) for each query
+        """
+        evidence_probability = self.joint_probability(evidence)
+        results = []
+        for nodes, values in queries:
+            assignment = dict(evidence)
+            consistent = True
+            for node, value in zip(nodes, values):
+                consistent &= assignment.setdefault(node, int(value)) == int(value)
+            joint = self.joint_probability(assignment) if consistent else 0
+            results.append(joint / evidence_probability if evidence_probability else float('nan'))
+        return results